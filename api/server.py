@@ -0,0 +1,246 @@
+"""
+API HTTP/JSON sin interfaz para capas y series (ASGI).
+
+Expone ``request_layer``/``request_series`` con la misma caché y base de datos
+que la app de Streamlit:
+
+    uvicorn api.server:app --host 0.0.0.0 --port 8000
+
+    GET /layer?source_id=2&var_id=5&start_date=2000-01-01&end_date=2000-12-31&agg=mean&format=png
+    GET /series?source_id=2&var_id=5&start_date=2000-01-01&end_date=2000-12-31&format=arrow
+    GET /metrics
+    GET /health
+
+Parámetros: source_id, var_id, start_date, end_date (obligatorios); var_key,
+agg, threshold, series_index, resample (D|MS|QS-DEC|YS), resample_how,
+bbox=lat_min,lat_max,lon_min,lon_max (opcionales).
+Formatos: capas ``netcdf`` (defecto), ``arrow`` o ``png``; series ``arrow``
+(defecto) o ``csv``.
+
+El ETag de cada respuesta es el hash de la clave de caché de la etapa, la
+versión del pipeline y la huella de los archivos fuente, así que
+``If-None-Match`` responde 304 sin calcular nada mientras el contenido no cambie. Peticiones idénticas
+simultáneas se agrupan: solo la primera calcula, el resto espera su resultado.
+"""
+import asyncio
+import hashlib
+import io
+import json
+import os
+import tempfile
+from datetime import date
+from urllib.parse import parse_qs
+
+from database.db_utils import DB_PATH, get_available_datasets
+from database.initialize_db import migrate_database
+from utils.dask_backend import get_metrics
+from utils.cache_manifest import PIPELINE_VERSION, source_fingerprint
+from utils.data_loader import get_file_name, get_source_paths, request_dataset, request_layer, request_series
+from utils.pipeline import stage_request
+
+LAYER_FORMATS = {
+    "netcdf": "application/x-netcdf",
+    "arrow": "application/vnd.apache.arrow.stream",
+    "png": "image/png",
+}
+SERIES_FORMATS = {
+    "arrow": "application/vnd.apache.arrow.stream",
+    "csv": "text/csv",
+}
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+# --------------------------------------------------------------------------- #
+#                          request → selection                                #
+# --------------------------------------------------------------------------- #
+def _optional_float(params: dict, name: str):
+    return float(params[name]) if params.get(name) not in (None, "") else None
+
+def parse_selection(params: dict) -> dict:
+    """Build a selection dict with the same keys and types as the sidebar's."""
+    try:
+        source_id, var_id = int(params["source_id"]), int(params["var_id"])
+        start_date = date.fromisoformat(params["start_date"])
+        end_date = date.fromisoformat(params["end_date"])
+    except KeyError as e:
+        raise HTTPError(400, f"Missing parameter {e.args[0]}") from None
+    except ValueError as e:
+        raise HTTPError(400, str(e)) from None
+
+    var_key = params.get("var_key")
+    if not var_key:
+        var_key = next(
+            (d.variable_key for d in get_available_datasets()
+             if d.source_id == source_id and d.variable_id == var_id),
+            None,
+        )
+        if var_key is None:
+            raise HTTPError(404, f"No dataset for source {source_id} and variable {var_id}")
+
+    bbox = None
+    if params.get("bbox"):
+        bbox = tuple(float(v) for v in params["bbox"].split(","))
+        if len(bbox) != 4:
+            raise HTTPError(400, "bbox must be lat_min,lat_max,lon_min,lon_max")
+
+    return {
+        "source_id": source_id,
+        "var_id": var_id,
+        "var_key": var_key,
+        "start_date": start_date,
+        "end_date": end_date,
+        "agg": params.get("agg", "mean"),
+        "threshold": _optional_float(params, "threshold"),
+        "series_index": params.get("series_index") or None,
+        "resample": params.get("resample") or None,
+        "resample_how": (params.get("resample_how") or "mean") if params.get("resample") else None,
+        "bbox": bbox,
+    }
+
+def get_etag(selection: dict, stage: str, fmt: str) -> str:
+    """Strong ETag derived from the stage's cache key, the response format, the
+    pipeline version and the source files' fingerprint (so it changes with the content)."""
+    request = stage_request(selection, stage)
+    fingerprint = source_fingerprint(get_source_paths(request))
+    key = f"{stage}:{get_file_name(request)}:{fmt}:{PIPELINE_VERSION}:{fingerprint}"
+    return '"' + hashlib.sha1(key.encode()).hexdigest() + '"'
+
+
+# --------------------------------------------------------------------------- #
+#                              encoders                                       #
+# --------------------------------------------------------------------------- #
+def _arrow_bytes(df) -> bytes:
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise HTTPError(501, "Arrow output requires pyarrow") from None
+    table = pa.Table.from_pandas(df.reset_index(), preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+def _netcdf_bytes(ds) -> bytes:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "layer.nc")
+        ds.to_netcdf(path)
+        with open(path, "rb") as f:
+            return f.read()
+
+def _png_bytes(ds) -> bytes:
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    from utils.grid_index import get_coord_names
+
+    lat_name, _ = get_coord_names(ds)
+    da = ds[list(ds.data_vars)[0]].squeeze()
+    lat = ds[lat_name].values
+    origin = "upper" if lat.size > 1 and lat[0] > lat[-1] else "lower"
+    buf = io.BytesIO()
+    plt.imsave(buf, da.values, cmap="Spectral_r", origin=origin, format="png")
+    return buf.getvalue()
+
+def compute_layer(selection: dict, fmt: str) -> bytes:
+    ds = request_dataset(stage_request(selection, "dataset"))
+    layer = request_layer(ds, stage_request(selection, "layer")).load()
+    if fmt == "png":
+        return _png_bytes(layer)
+    if fmt == "arrow":
+        return _arrow_bytes(layer.to_dataframe())
+    return _netcdf_bytes(layer)
+
+def compute_series(selection: dict, fmt: str) -> bytes:
+    ds = request_dataset(stage_request(selection, "dataset"))
+    series = request_series(ds, stage_request(selection, "series"))
+    if fmt == "csv":
+        return series.to_csv().encode()
+    return _arrow_bytes(series.to_frame() if series.ndim == 1 else series)
+
+
+# --------------------------------------------------------------------------- #
+#                                ASGI app                                     #
+# --------------------------------------------------------------------------- #
+# Cálculos en curso por ETag: las peticiones idénticas esperan el mismo futuro
+_INFLIGHT = {}
+
+async def _coalesced(etag: str, func, *args) -> bytes:
+    future = _INFLIGHT.get(etag)
+    if future is None:
+        future = asyncio.ensure_future(asyncio.to_thread(func, *args))
+        _INFLIGHT[etag] = future
+        future.add_done_callback(lambda _: _INFLIGHT.pop(etag, None))
+    return await asyncio.shield(future)
+
+async def _send(send, status: int, body: bytes, content_type: str, headers: list = ()):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", content_type.encode()),
+            (b"content-length", str(len(body)).encode()),
+            *headers,
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+async def _send_json(send, status: int, payload: dict):
+    await _send(send, status, json.dumps(payload, default=str).encode(), "application/json")
+
+async def _handle_data(scope, send, stage: str, formats: dict, compute, default_fmt: str):
+    params = {k: v[-1] for k, v in parse_qs(scope["query_string"].decode()).items()}
+    fmt = params.get("format", default_fmt)
+    if fmt not in formats:
+        raise HTTPError(400, f"Invalid format '{fmt}'. Use one of {list(formats)}.")
+
+    selection = parse_selection(params)
+    etag = get_etag(selection, stage, fmt)
+    headers = [(b"etag", etag.encode()), (b"cache-control", b"no-cache")]
+
+    request_headers = dict(scope.get("headers", []))
+    if_none_match = request_headers.get(b"if-none-match", b"").decode()
+    if etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+        await _send(send, 304, b"", formats[fmt], headers)
+        return
+
+    body = await _coalesced(etag, compute, selection, fmt)
+    await _send(send, 200, body, formats[fmt], headers)
+
+async def app(scope, receive, send):
+    """ASGI entry point."""
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                migrate_database(DB_PATH)
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+    if scope["type"] != "http":
+        return
+
+    try:
+        if scope["method"] != "GET":
+            raise HTTPError(405, "Only GET is supported")
+        path = scope["path"].rstrip("/")
+        if path == "/layer":
+            await _handle_data(scope, send, "layer", LAYER_FORMATS, compute_layer, "netcdf")
+        elif path == "/series":
+            await _handle_data(scope, send, "series", SERIES_FORMATS, compute_series, "arrow")
+        elif path == "/metrics":
+            await _send_json(send, 200, await asyncio.to_thread(get_metrics))
+        elif path == "/health":
+            await _send_json(send, 200, {"status": "ok"})
+        else:
+            raise HTTPError(404, f"Unknown path {scope['path']}")
+    except HTTPError as e:
+        await _send_json(send, e.status, {"error": e.message})
+    except (ValueError, FileNotFoundError) as e:
+        await _send_json(send, 400, {"error": str(e)})
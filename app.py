@@ -2,12 +2,9 @@ import streamlit as st
 from pathlib import Path
 
 from utils.cache import cache_resource
-from utils.data_loader import request_dataset, request_layer, request_series
-from components.sidebar import render_sidebar
-from components.map_view import render_map
-from components.metrics import render_metrics
-from components.series_view import render_series
-from components.roadmap_expander import render_roadmap
+from database.db_utils import DB_PATH
+from database.initialize_db import migrate_database
+from components.sidebar import AGGREGATION_LABELS, render_sidebar
 
 st.set_page_config(
     page_title="ERA5 Climate Explorer",
@@ -16,42 +13,59 @@ st.set_page_config(
     initial_sidebar_state="expanded",
 )
 
-# Initialize session state for first load
-if 'is_first_load' not in st.session_state:
-    st.session_state.is_first_load = True
-
+# Esquema de la base de datos al día (columnas nuevas), una vez por servidor
+cache_resource(migrate_database)(DB_PATH)
 
 # ---------- 1. UI (sidebar) ----------
 selection = render_sidebar()
 print(f"Selection: {selection}")
-# On first load, trigger a default request
-if st.session_state.is_first_load:
-    st.session_state.is_first_load = False
-    st.session_state.update({
-        'dataset': request_dataset(selection),
-        'layer': None,
-        'series': None
-    })
-
-# ---------- 2. Request dataset ----------
-ds = st.session_state.get('dataset')
-print(f"Dataset: {ds}")
-if ds is None or selection != st.session_state.get('last_selection', {}):
-    ds = request_dataset(selection)
-    st.session_state.dataset = ds
-    st.session_state.last_selection = selection.copy()
-
-# ---------- 3. request layer and series ----------
-layer = st.session_state.get('layer')
-series = st.session_state.get('series')
-
-if layer is None or selection != st.session_state.get('last_selection', {}):
-    print(f"Requesting layer for selection: {selection}")
-    layer = request_layer(ds, selection)
-    print(f"Requesting series for selection: {selection}")
-    series = request_series(ds, selection)
-    st.session_state.layer = layer
-    st.session_state.series = series
+
+# Imports pesados (xarray/dask/plotly) después de pintar el sidebar: en un
+# contenedor nuevo el usuario ve los controles mientras se cargan. En los
+# reruns siguientes ya están en sys.modules y no cuestan nada.
+from utils.data_loader import dataset_version, request_dataset, request_layer, request_series, request_point_series, request_comparison, request_frames
+from components.map_view import render_map, get_selected_points
+from components.animation_view import render_animation
+from components.series_view import render_series, render_point_series, render_comparison_series
+from components.roadmap_expander import render_roadmap
+from components.stage_timings import render_stage_timings
+from utils.pipeline import Pipeline
+from utils.dask_backend import get_backend, get_metrics
+from utils import tracing
+from components.trace_panel import render_trace_panel
+
+# Backend de Dask (hilos / LocalCluster / síncrono) creado una vez por
+# servidor y compartido por todas las sesiones.
+cache_resource(get_backend)()
+
+# Puntos clicados en el mapa en el rerun anterior
+selection["points"] = get_selected_points()
+
+# ---------- 2. Request dataset, layer and series ----------
+# Cada etapa se memoiza sobre sus propias entradas: cambiar la agregación solo
+# recalcula la capa, cambiar las fechas no vuelve a abrir el dataset.
+pipeline = Pipeline(
+    state=st.session_state,
+    funcs={
+        "dataset": request_dataset,
+        "layer": request_layer,
+        "series": request_series,
+        "points": request_point_series,
+        "compare": request_comparison,
+        "frames": request_frames,
+    },
+    # archivos fuente nuevos o reescritos reabren el dataset y rehacen sus etapas
+    versions={"dataset": dataset_version},
+)
+with tracing.collect() as spans:
+    try:
+        results = pipeline.run(selection)
+    except ValueError as e:
+        # selecciones que los datos no admiten (p.ej. rachas de días sobre medias mensuales)
+        st.error(str(e))
+        st.stop()
+ds, layer, series = results["dataset"], results["layer"], results["series"]
+render_stage_timings(pipeline.timings, get_metrics())
 
 # ---------- 4. Visualización ----------
 label = f"{selection['source_name']} - {selection['var_name']}"
@@ -62,12 +76,31 @@ st.markdown(f"**{label}**")
 
 title = f"{label} ({ds.attrs.get('units','')}) – {title_suffix}"
 print(layer)
-render_map(layer, title)
+with tracing.collect() as render_spans:
+    render_map(layer, title)
 
+render_animation(results["frames"], f"{label} – {AGGREGATION_LABELS[selection['agg']].lower()} mensual")
+
+# ---------- 5. Comparación entre fuentes ----------
+comparison = results.get("compare")
+if comparison is not None:
+    other_label = comparison["series"].columns[1]
+    render_map(
+        comparison["difference"],
+        f"Diferencia {label} − {other_label} – {title_suffix}",
+        key="compare_map_chart",
+    )
 
 # ---------- 7. Series temporales ----------
 st.divider()
 render_series(series, series.attrs.get("units", ""))
+render_point_series(results["points"], selection["unit"])
+if comparison is not None:
+    render_comparison_series(comparison["series"], comparison["correlation"], selection["unit"])
+
+# Traza por etapas (solo con ERA5_TRACE=1)
+if tracing.is_enabled():
+    render_trace_panel(spans + render_spans)
 
 # ---------- 8. Roadmap / footer ----------
 render_roadmap()
\ No newline at end of file
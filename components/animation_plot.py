@@ -0,0 +1,67 @@
+# animation_plot.py
+import numpy as np
+import plotly.graph_objects as go
+from plotly.colors import sample_colorscale
+
+from utils.frames import LEVELS, NODATA
+
+def _uint8_colorscale(name: str, n_stops: int = 16) -> list:
+    """Colorscale over 0..255 where 0..254 follow `name` and 255 (sin dato) is transparent."""
+    top = LEVELS / NODATA
+    colors = sample_colorscale(name, list(np.linspace(0, 1, n_stops)))
+    stops = [[top * i / (n_stops - 1), c] for i, c in enumerate(colors)]
+    stops.append([(LEVELS + 0.5) / NODATA, "rgba(0,0,0,0)"])
+    stops.append([1.0, "rgba(0,0,0,0)"])
+    return stops
+
+def plot_animated_map(encoded: dict, title: str = "Animación", color_scale: str = "Spectral_r",
+                      n_ticks: int = 6) -> go.Figure:
+    """
+    Animación Plotly de fotogramas uint8 preencodificados (ver utils.frames).
+    Todos los fotogramas viajan al navegador en la figura: el slider y el botón
+    de reproducción no vuelven a pedir nada al servidor.
+    """
+    frames, lat, lon, labels = encoded["frames"], encoded["lat"], encoded["lon"], encoded["labels"]
+    tick_codes = np.linspace(0, LEVELS, n_ticks)
+    tick_text = [f"{encoded['vmin'] + c * encoded['step']:.3g}" for c in tick_codes]
+
+    def heatmap(z):
+        return go.Heatmap(
+            z=z, x=lon, y=lat,
+            zmin=0, zmax=NODATA,
+            colorscale=_uint8_colorscale(color_scale),
+            colorbar=dict(tickvals=tick_codes, ticktext=tick_text),
+            hoverinfo="skip",
+        )
+
+    fig = go.Figure(
+        data=[heatmap(frames[0])],
+        frames=[go.Frame(data=[heatmap(z)], name=str(label)) for z, label in zip(frames, labels)],
+    )
+    fig.update_layout(
+        title=title,
+        template="plotly_white",
+        margin=dict(l=10, r=10, t=50, b=10),
+        updatemenus=[dict(
+            type="buttons",
+            showactive=False,
+            x=0, y=0, xanchor="left", yanchor="top",
+            buttons=[
+                dict(label="▶", method="animate",
+                     args=[None, dict(frame=dict(duration=200, redraw=True), fromcurrent=True)]),
+                dict(label="⏸", method="animate",
+                     args=[[None], dict(frame=dict(duration=0, redraw=False), mode="immediate")]),
+            ],
+        )],
+        sliders=[dict(
+            active=0,
+            x=0.1, len=0.9,
+            steps=[
+                dict(label=str(label), method="animate",
+                     args=[[str(label)], dict(mode="immediate", frame=dict(duration=0, redraw=True))])
+                for label in labels
+            ],
+        )],
+    )
+    fig.update_yaxes(scaleanchor="x")
+    return fig
@@ -0,0 +1,10 @@
+import streamlit as st
+from components.animation_plot import plot_animated_map
+
+def render_animation(encoded, title):
+    """Muestra la animación mensual con slider temporal (cómputo en el navegador)."""
+    if encoded is None:
+        return
+    with st.expander("Animación mensual", expanded=True):
+        fig = plot_animated_map(encoded, title=title)
+        st.plotly_chart(fig, use_container_width=True)
@@ -2,18 +2,25 @@
 import numpy as np
 import xarray as xr
 import plotly.graph_objects as go
-from typing import Dict, Literal, Optional
-
-# --- NEW ---
-import cartopy.crs as ccrs
+from typing import TYPE_CHECKING, Dict, Literal, Optional
 from functools import lru_cache
 
+from utils.tracing import traced
+
+if TYPE_CHECKING:
+    import cartopy.crs as ccrs
+
+# cartopy es pesado (~1 s de import con shapely/pyproj): solo se carga
+# cuando se dibuja una proyección distinta de lat/lon.
+
 # --------------------------------------------------------------------------- #
 #                              helpers                                        #
 # --------------------------------------------------------------------------- #
 @lru_cache
-def _cartopy_proj(name: str) -> ccrs.Projection:
+def _cartopy_proj(name: str) -> "ccrs.Projection":
     """Devuelve la proyección cartopy correspondiente al string de Plotly."""
+    import cartopy.crs as ccrs
+
     name = name.lower()
     if name in ("robinson", "robin"):
         return ccrs.Robinson()
@@ -27,10 +34,12 @@ def _cartopy_proj(name: str) -> ccrs.Projection:
     return ccrs.PlateCarree()
 
 def _to_proj_xy(lon_2d: np.ndarray, lat_2d: np.ndarray,
-                target: ccrs.Projection) -> tuple[np.ndarray, np.ndarray]:
+                target: "ccrs.Projection") -> tuple[np.ndarray, np.ndarray]:
     """
     Transforma lon/lat (º) → x/y (m) en la proyección destino (Cartopy).
     """
+    import cartopy.crs as ccrs
+
     src = ccrs.PlateCarree()
     pts = target.transform_points(src, lon_2d, lat_2d)
     return pts[..., 0], pts[..., 1]        # x, y
@@ -39,6 +48,7 @@ def _to_proj_xy(lon_2d: np.ndarray, lat_2d: np.ndarray,
 # --------------------------------------------------------------------------- #
 #                           main plotting func                                #
 # --------------------------------------------------------------------------- #
+@traced("render.map")
 def plot_spatial_map(
         data: xr.DataArray,
         title: str = "Spatial Map",
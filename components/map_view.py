@@ -1,12 +1,33 @@
 import streamlit as st
 from components.map_plot import plot_spatial_map  # ya existente
 
-def render_map(da, title):
-    """Genera la figura y la muestra ocupando todo el ancho disponible."""
+MAP_KEY = "map_chart"
+
+def render_map(da, title, key=MAP_KEY):
+    """Genera la figura y la muestra ocupando todo el ancho disponible.
+    Los clics sobre el mapa principal quedan en st.session_state[MAP_KEY] (ver get_selected_points)."""
     fig = plot_spatial_map(
         da,
         title=title,
         projection="robinson",
         color_scale="Spectral_r",
     )
-    st.plotly_chart(fig, use_container_width=True)
\ No newline at end of file
+    st.plotly_chart(
+        fig,
+        use_container_width=True,
+        key=key,
+        on_select="rerun",
+        selection_mode="points",
+    )
+
+def get_selected_points():
+    """Devuelve los puntos (lat, lon) seleccionados en el mapa en el último rerun."""
+    event = st.session_state.get(MAP_KEY)
+    if not event:
+        return ()
+    points = event.get("selection", {}).get("points", [])
+    # el mapa proyectado guarda [lat, lon] en customdata
+    return tuple(
+        (round(float(p["customdata"][0]), 4), round(float(p["customdata"][1]), 4))
+        for p in points if p.get("customdata")
+    )
@@ -36,4 +36,30 @@ def plot_time_series(da: pd.Series, units=""):
         height=400
     )
     
-    return fig
\ No newline at end of file
+    return fig
+
+
+def plot_point_series(df: pd.DataFrame, units="", title="Series temporales - Puntos seleccionados"):
+    """
+    Crea un gráfico con una curva por columna (puntos seleccionados, fuentes comparadas...).
+
+    Args:
+        df: DataFrame con índice temporal y una columna por curva
+        units: unidades de la variable para mostrar en el eje y
+        title: título del gráfico
+    """
+    fig = go.Figure()
+    for column in df.columns:
+        fig.add_trace(
+            go.Scatter(x=df.index, y=df[column].values, mode='lines', name=column)
+        )
+
+    fig.update_layout(
+        title=title,
+        xaxis_title="Tiempo",
+        yaxis_title=f"Valor ({units})",
+        showlegend=True,
+        template="plotly_white",
+        height=400
+    )
+    return fig
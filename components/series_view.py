@@ -1,5 +1,5 @@
 import streamlit as st
-from .series_plot import plot_time_series
+from .series_plot import plot_time_series, plot_point_series
 
 def render_series(da, units=""):
     """
@@ -11,4 +11,34 @@ def render_series(da, units=""):
     """
     with st.expander("Ver serie temporal", expanded=False):
         fig = plot_time_series(da, units)
-        st.plotly_chart(fig, use_container_width=True)
\ No newline at end of file
+        st.plotly_chart(fig, use_container_width=True)
+
+def render_point_series(df, units=""):
+    """
+    Renderiza las series de los puntos seleccionados en el mapa.
+
+    Args:
+        df: DataFrame con una columna por punto (o None si no hay puntos)
+        units: unidades de la variable
+    """
+    if df is None:
+        st.caption("Haga clic en el mapa para ver la serie de un punto.")
+        return
+    with st.expander("Series de puntos seleccionados", expanded=True):
+        fig = plot_point_series(df, units)
+        st.plotly_chart(fig, use_container_width=True)
+
+
+def render_comparison_series(df, correlation, units=""):
+    """
+    Renderiza las series de las dos fuentes comparadas y su correlación.
+
+    Args:
+        df: DataFrame con una columna por fuente
+        correlation: coeficiente de correlación de Pearson entre ambas
+        units: unidades de la variable
+    """
+    with st.expander("Comparación de series entre fuentes", expanded=True):
+        st.metric("Correlación", f"{correlation:.3f}")
+        fig = plot_point_series(df, units, title="Series temporales - Comparación de fuentes")
+        st.plotly_chart(fig, use_container_width=True)
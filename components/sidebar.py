@@ -6,6 +6,39 @@ from typing import Dict, Any
 from database.db_utils import get_available_datasets
 from utils.cache import cache_data
 
+# Dominios predefinidos: (lat_min, lat_max, lon_min, lon_max). None = global.
+DOMAINS = {
+    "Global": None,
+    "Sudamérica": (-60.0, 15.0, -90.0, -30.0),
+    "Chile": (-56.0, -17.0, -76.0, -66.0),
+    "Pacífico tropical": (-20.0, 20.0, 150.0, 280.0),
+}
+
+# Agregaciones temporales (ver utils.aggregations.AGGREGATIONS)
+AGGREGATION_LABELS = {
+    "mean": "Media",
+    "sum": "Suma",
+    "max": "Máximo",
+    "min": "Mínimo",
+    "p90": "Percentil 90",
+    "p99": "Percentil 99",
+    "count_gt": "Pasos sobre umbral",
+    "count_lt": "Pasos bajo umbral",
+    "spell_gt": "Racha máx. de días sobre umbral",
+}
+THRESHOLD_AGGREGATIONS = ("count_gt", "count_lt", "spell_gt")
+# Agregaciones que la animación mensual puede mostrar (ver utils.frames.FRAME_AGGREGATIONS)
+FRAME_AGGREGATIONS = ("mean", "sum", "max", "min")
+
+# Resolución temporal (ver utils.aggregations.RESAMPLE_FREQS)
+RESAMPLE_LABELS = {
+    None: "Nativa",
+    "D": "Diaria",
+    "MS": "Mensual",
+    "QS-DEC": "Estacional (DJF, MAM, JJA, SON)",
+    "YS": "Anual",
+}
+
 @cache_data
 def get_datasets_cache():
     """Cache the datasets to avoid multiple database calls"""
@@ -44,6 +77,13 @@ def get_default_selection():
         "start_date": start_date,
         "end_date": end_date,
         "agg": "mean",
+        "threshold": None,
+        "series_index": None,
+        "resample": None,
+        "resample_how": None,
+        "bbox": DOMAINS["Global"],
+        "compare": None,
+        "animate": False,
     }
 
 def render_sidebar() -> Dict[str, Any]:
@@ -126,11 +166,104 @@ def render_sidebar() -> Dict[str, Any]:
     # 4️⃣ Aggregation Method
     agg = st.sidebar.selectbox(
         "Agregación",
-        ["mean", "sum"],
+        list(AGGREGATION_LABELS),
+        format_func=AGGREGATION_LABELS.get,
         key="agg_method",
         index=0
     )
 
+    # Índice anual de la serie (ETCCDI): un valor por año sobre la media del dominio
+    series_index = st.sidebar.selectbox(
+        "Índice anual de la serie",
+        [None] + [a for a in AGGREGATION_LABELS if a not in ("mean", "sum")],
+        format_func=lambda x: "Ninguno (paso nativo)" if x is None else AGGREGATION_LABELS[x],
+        key="series_index",
+        index=0
+    )
+
+    # Resolución temporal: la capa agrega sobre los períodos remuestreados
+    # (p.ej. media de máximos anuales) y la serie se muestra a esa resolución
+    resample = st.sidebar.selectbox(
+        "Resolución temporal",
+        list(RESAMPLE_LABELS),
+        format_func=RESAMPLE_LABELS.get,
+        key="resample",
+        index=0
+    )
+    resample_how = None
+    if resample is not None:
+        resample_how = st.sidebar.selectbox(
+            "Agregación por período",
+            ["mean", "sum", "max"],
+            format_func=AGGREGATION_LABELS.get,
+            key="resample_how",
+            index=0
+        )
+
+    threshold = None
+    if agg in THRESHOLD_AGGREGATIONS or series_index in THRESHOLD_AGGREGATIONS:
+        threshold = st.sidebar.number_input(
+            f"Umbral ({unit})",
+            value=0.0,
+            format="%g",
+            key="threshold",
+        )
+
+    # 5️⃣ Spatial domain (se recorta al leer, antes de agregar)
+    domain = st.sidebar.selectbox(
+        "Dominio",
+        list(DOMAINS) + ["Personalizado"],
+        key="domain_select",
+        index=0
+    )
+    if domain == "Personalizado":
+        lat_min, lat_max = st.sidebar.slider(
+            "Latitud", -90.0, 90.0, (-60.0, 15.0), step=0.25, key="domain_lat"
+        )
+        lon_min, lon_max = st.sidebar.slider(
+            "Longitud", -180.0, 360.0, (-90.0, -30.0), step=0.25, key="domain_lon"
+        )
+        bbox = (lat_min, lat_max, lon_min, lon_max)
+    else:
+        bbox = DOMAINS[domain]
+
+    # Animación: todas las capas mensuales del rango en un slider (cada mes con
+    # la agregación elegida; percentiles y umbrales no se animan)
+    can_animate = agg in FRAME_AGGREGATIONS
+    animate = st.sidebar.checkbox(
+        "Animación mensual",
+        key="animate",
+        disabled=not can_animate,
+        help=None if can_animate else "Disponible solo con media, suma, máximo o mínimo.",
+    ) and can_animate
+
+    # 6️⃣ Comparación con otra fuente (se regrilla sobre la grilla de la actual)
+    compare = None
+    if st.sidebar.checkbox("Comparar con otra fuente", key="compare_enabled"):
+        # solo la misma variable en otras fuentes: restar variables distintas
+        # (p.ej. Pa − K) no es una diferencia
+        all_datasets = [
+            (d.source_id, d.source_name, d.variable_id, d.long_name, d.variable_key)
+            for d in available_datasets
+            if d.variable_id == var_id and d.source_id != source_id
+        ]
+        if not all_datasets:
+            st.sidebar.warning("No hay otras fuentes con esta variable para comparar.")
+        else:
+            other = st.sidebar.selectbox(
+                "Comparar con",
+                all_datasets,
+                format_func=lambda x: f"{x[1]} - {x[3]}",
+                key="compare_select",
+            )
+            method = st.sidebar.selectbox(
+                "Regrillado",
+                ["bilinear", "conservative"],
+                format_func={"bilinear": "Bilineal", "conservative": "Conservativo"}.get,
+                key="compare_method",
+            )
+            compare = (other[0], other[2], other[4], method)
+
     # Return selection dictionary
     return {
         "source_id": source_id,
@@ -143,4 +276,11 @@ def render_sidebar() -> Dict[str, Any]:
         "start_date": selected_start,
         "end_date": selected_end,
         "agg": agg,
+        "threshold": threshold,
+        "series_index": series_index,
+        "resample": resample,
+        "resample_how": resample_how,
+        "bbox": bbox,
+        "compare": compare,
+        "animate": animate,
     }
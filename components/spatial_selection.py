@@ -1,13 +1,19 @@
 import numpy as np
 import xarray as xr
 
+from utils.grid_index import extract_points, get_coord_names, get_grid_index
+
 
 def get_point_index(lat_array, lon_array, selected_lat, selected_lon):
     """
-    Encuentra el índice más cercano para una coordenada lat/lon.
+    Encuentra el índice más cercano para una o varias coordenadas lat/lon.
+    El índice de la grilla se reutiliza entre llamadas (ver grid_index.get_grid_index).
     """
-    lat_idx = np.abs(lat_array - selected_lat).argmin()
-    lon_idx = np.abs(lon_array - selected_lon).argmin()
+    grid = xr.Dataset(coords={"lat": np.asarray(lat_array), "lon": np.asarray(lon_array)})
+    indexers = get_grid_index(grid).query(selected_lat, selected_lon)
+    lat_idx, lon_idx = indexers["lat"], indexers["lon"]
+    if np.ndim(selected_lat) == 0 and np.ndim(selected_lon) == 0:
+        return int(lat_idx[0]), int(lon_idx[0])
     return lat_idx, lon_idx
 
 
@@ -15,8 +21,7 @@ def extract_point_timeseries(dataset: xr.DataArray, lat: float, lon: float) -> x
     """
     Extrae una serie temporal para un punto dado (lat, lon).
     """
-    lat_idx, lon_idx = get_point_index(dataset.lat.values, dataset.lon.values, lat, lon)
-    return dataset.isel(lat=lat_idx, lon=lon_idx)
+    return extract_points(dataset, lat, lon).isel(point=0)
 
 
 def extract_region_timeseries(dataset: xr.DataArray, lat_min: float, lat_max: float,
@@ -25,14 +30,17 @@ def extract_region_timeseries(dataset: xr.DataArray, lat_min: float, lat_max: fl
     Extrae una serie temporal para una región definida por un rectángulo.
     Aplica el método de agregación especificado ("mean", "sum", etc).
     """
-    ds_region = dataset.sel(
-        lat=slice(lat_max, lat_min),  # invertir si latitudes decrecen
-        lon=slice(lon_min, lon_max)
-    )
+    lat_name, lon_name = get_coord_names(dataset)
+    lat_values = dataset[lat_name].values
+    descending = lat_values.size > 1 and lat_values[0] > lat_values[-1]
+    ds_region = dataset.sel({
+        lat_name: slice(lat_max, lat_min) if descending else slice(lat_min, lat_max),
+        lon_name: slice(lon_min, lon_max),
+    })
 
     if method == "mean":
-        return ds_region.mean(dim=["lat", "lon"])
+        return ds_region.mean(dim=[lat_name, lon_name])
     elif method == "sum":
-        return ds_region.sum(dim=["lat", "lon"])
+        return ds_region.sum(dim=[lat_name, lon_name])
     else:
         raise ValueError(f"Unsupported aggregation method: {method}")
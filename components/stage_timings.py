@@ -0,0 +1,20 @@
+import streamlit as st
+
+def render_stage_timings(timings, metrics=None):
+    """Muestra en el sidebar el tiempo de cada etapa del último rerun y,
+    si se pasan, las métricas del backend de Dask."""
+    with st.sidebar.expander("Tiempos de cómputo", expanded=False):
+        for stage, timing in timings.items():
+            status = "recalculado" if timing.recomputed else "en memoria"
+            st.caption(f"**{stage}**: {timing.seconds * 1000:.0f} ms ({status})")
+        if metrics:
+            st.caption(
+                f"Dask ({metrics['backend']}): {metrics['tasks_completed']} tareas, "
+                f"{metrics['tasks_per_s']} tareas/s"
+            )
+            if "spilled_bytes" in metrics:
+                st.caption(
+                    f"{metrics['workers']} workers, "
+                    f"memoria {metrics['memory_bytes'] / 2**20:.0f} MiB, "
+                    f"spill {metrics['spilled_bytes'] / 2**20:.0f} MiB"
+                )
@@ -0,0 +1,20 @@
+import streamlit as st
+
+def render_trace_panel(spans):
+    """Muestra en el sidebar los spans del último rerun (load → reduce → render),
+    anidados por profundidad, con duración, bytes y tareas de Dask."""
+    with st.sidebar.expander("Traza por etapas", expanded=False):
+        if not spans:
+            st.caption("Sin spans en este rerun.")
+            return
+        for span in sorted(spans, key=lambda s: s.start_ns):
+            attrs = span.attributes
+            details = [f"{span.duration_ms:.0f} ms"]
+            if "bytes" in attrs:
+                details.append(f"{attrs['bytes'] / 2**20:.1f} MiB")
+            if "dask_tasks" in attrs:
+                details.append(f"{attrs['dask_tasks']} tareas")
+            if attrs.get("recomputed") is False:
+                details.append("en memoria")
+            indent = " " * span.depth
+            st.caption(f"{indent}**{span.name}**: {', '.join(details)}")
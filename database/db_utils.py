@@ -14,9 +14,31 @@ class Dataset:
     unit: str
     path: str
 
+@dataclass
+class Variable:
+    id: int
+    name: str
+    long_name: str
+    unit: str
+    precision: float
+    formula: str
+
+@dataclass
+class Source:
+    id: int
+    name: str
+    lat_key: str
+    lon_key: str
+    time_key: str
+    lvl_key: str
+    x_key: str
+    y_key: str
+
+DB_PATH = 'database/climate_studio.db'
+
 def get_db_connection():
     """Create a database connection"""
-    return sqlite3.connect('database/climate_studio.db')
+    return sqlite3.connect(DB_PATH)
 
 def get_available_datasets() -> List[Dataset]:
     """
@@ -89,4 +111,57 @@ def get_path(source_id: int, variable_id: int) -> str:
         cursor = conn.cursor()
         cursor.execute(query, (source_id, variable_id))
         path = cursor.fetchone()[0]
-        return path if path else None
\ No newline at end of file
+        return path if path else None
+
+def get_source(source_id: int) -> Source:
+    """
+    Get the coordinate names of a specific source.
+    Returns a Source object, or None if the source does not exist.
+    """
+    query = """
+    SELECT id, name, lat_key, lon_key, time_key, lvl_key, x_key, y_key
+    FROM sources
+    WHERE id = ?
+    """
+
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(query, (source_id,))
+        row = cursor.fetchone()
+        return Source(*row) if row else None
+
+
+def get_variable(variable_id: int) -> Variable:
+    """
+    Get the metadata of a specific variable (unit, storage precision and formula).
+    Returns a Variable object, or None if the variable does not exist.
+    """
+    query = """
+    SELECT id, name, long_name, unit, precision, formula
+    FROM variables
+    WHERE id = ?
+    """
+
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(query, (variable_id,))
+        row = cursor.fetchone()
+        return Variable(*row) if row else None
+
+
+def get_source_datasets(source_id: int) -> Dict[str, str]:
+    """
+    Get the stored (non-derived) datasets of a source.
+    Returns a dict mapping variable_key to path.
+    """
+    query = """
+    SELECT d.variable_key, d.path
+    FROM datasets d
+    JOIN variables v ON d.variable_id = v.id
+    WHERE d.source_id = ? AND d.available = 1 AND v.formula IS NULL
+    """
+
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(query, (source_id,))
+        return {key: path for key, path in cursor.fetchall()}
@@ -1,6 +1,80 @@
 import sqlite3
 import os
 
+# Resolución útil al guardar en caché (variables.precision), por nombre de variable
+VARIABLE_PRECISIONS = {
+    "geopotential": 1.0,
+    "mean sea level pressure": 1.0,
+    "time-mean top net long-wave radiation flux": 0.01,
+    "sea surface temperature": 0.001,
+    "total precipitation": 1e-06,
+}
+
+# Variables derivadas (variables.formula) y sus datasets: se agregan a cada fuente
+# que tenga todas las variables de la fórmula. El path de un derivado es NULL.
+# (name, long_name, unit, precision, formula, variable_key, variable_keys de entrada)
+DERIVED_VARIABLES = [
+    ("total precipitation mm", "Total precipitation (mm)", "mm", 0.001, "tp * 1000", "tp_mm", ("tp",)),
+]
+
+def _add_column(cursor, table: str, column: str, definition: str):
+    """ALTER TABLE ... ADD COLUMN unless the column already exists."""
+    columns = [row[1] for row in cursor.execute(f"PRAGMA table_info({table});")]
+    if column not in columns:
+        print(f"Adding column {table}.{column}")
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition};")
+
+def migrate_database(db_path="database/climate_studio.db"):
+    """
+    Bring an existing database up to the current schema and seed the values of
+    the new columns. Idempotent: safe to run on every startup and after
+    initialize_database.
+    """
+    conn = None
+    try:
+        conn = sqlite3.connect(db_path)
+        cursor = conn.cursor()
+
+        # variables.precision (empaquetado int16 de la caché)
+        _add_column(cursor, "variables", "precision", "REAL NULL")
+        cursor.executemany(
+            "UPDATE variables SET precision = ? WHERE name = ? AND precision IS NULL;",
+            [(precision, name) for name, precision in VARIABLE_PRECISIONS.items()],
+        )
+
+        # variables.formula (variables derivadas)
+        _add_column(cursor, "variables", "formula", "TEXT NULL")
+        for name, long_name, unit, precision, formula, key, inputs in DERIVED_VARIABLES:
+            cursor.execute(
+                "INSERT OR IGNORE INTO variables (name, long_name, unit, precision, formula) VALUES (?, ?, ?, ?, ?);",
+                (name, long_name, unit, precision, formula),
+            )
+            (variable_id,) = cursor.execute("SELECT id FROM variables WHERE name = ?;", (name,)).fetchone()
+            placeholders = ", ".join("?" * len(inputs))
+            cursor.execute(f"""
+                INSERT OR IGNORE INTO datasets (source_id, variable_id, variable_key, available, path)
+                SELECT source_id, ?, ?, 1, NULL
+                FROM datasets
+                WHERE variable_key IN ({placeholders}) AND available = 1
+                GROUP BY source_id
+                HAVING COUNT(DISTINCT variable_key) = ?;
+            """, (variable_id, key, *inputs, len(inputs)))
+        # antes se guardaba 'derived' en path: un derivado se reconoce por variables.formula
+        cursor.execute("""
+            UPDATE datasets SET path = NULL
+            WHERE variable_id IN (SELECT id FROM variables WHERE formula IS NOT NULL);
+        """)
+
+        conn.commit()
+    except sqlite3.Error as e:
+        print(f"An error occurred while migrating the database: {e}")
+        if conn:
+            conn.rollback()
+        raise
+    finally:
+        if conn:
+            conn.close()
+
 def initialize_database(db_path="database"):
     """
     Initializes the SQLite database with the required schema.
@@ -60,7 +134,9 @@ def initialize_database(db_path="database"):
             id INTEGER PRIMARY KEY,                     -- Identificador único
             name TEXT NOT NULL UNIQUE,                  -- Nombre corto ('t2m', 'tp')
             long_name TEXT,                             -- Nombre descriptivo
-            unit TEXT                                   -- Unidades ('K', 'm')
+            unit TEXT,                                  -- Unidades ('K', 'm')
+            precision REAL NULL,                        -- Resolución útil al guardar en caché (en 'unit'); NULL = float32
+            formula TEXT NULL                           -- Variable derivada: expresión sobre variable_key de la misma fuente ('sqrt(u10**2 + v10**2)')
         );
         """)
 
@@ -72,7 +148,7 @@ def initialize_database(db_path="database"):
             variable_id INTEGER NOT NULL,               -- FK a variables
             variable_key TEXT NOT NULL,                 -- Nombre de la variable DENTRO del archivo fuente
             available INTEGER DEFAULT 1,                -- 0=False, 1=True
-            path TEXT NULL,                             -- Ruta al archivo fuente (opcional)
+            path TEXT NULL,                             -- Ruta al archivo fuente (NULL si la variable tiene formula)
 
             FOREIGN KEY (source_id) REFERENCES sources (id)
                 ON DELETE RESTRICT ON UPDATE CASCADE,
@@ -183,6 +259,7 @@ def initialize_database(db_path="database"):
         # --- Confirmar cambios ---
         conn.commit()
         print("Database initialized successfully.")
+        migrate_database(db_path)
 
     except sqlite3.Error as e:
         print(f"An error occurred: {e}")
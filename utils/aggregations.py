@@ -1,18 +1,96 @@
+import re
+
+import numpy as np
 import xarray as xr
 import pandas as pd
 
-def get_aggregation_time(ds: xr.Dataset, type: str) -> xr.Dataset:
+from utils.tracing import traced
+
+# Agregaciones temporales disponibles para capas y series. Las de umbral
+# (count_*, spell_*) requieren ``threshold`` en las unidades de la variable.
+AGGREGATIONS = ["mean", "sum", "max", "min", "p90", "p99", "count_gt", "count_lt", "spell_gt"]
+THRESHOLD_AGGREGATIONS = ("count_gt", "count_lt", "spell_gt")
+
+def parse_percentile(type: str):
+    """Return the percentile of a 'pNN' aggregation (e.g. 'p90' -> 90.0), else None."""
+    match = re.fullmatch(r"p(\d+(?:\.\d+)?)", type or "")
+    return float(match.group(1)) if match else None
+
+def _longest_run(mask: np.ndarray) -> np.ndarray:
+    """Longest run of consecutive True values along the last axis."""
+    if mask.shape[-1] == 0:
+        return np.zeros(mask.shape[:-1], dtype="int64")
+    ones = mask.astype("int64")
+    count = np.cumsum(ones, axis=-1)
+    last_reset = np.maximum.accumulate(np.where(ones == 0, count, 0), axis=-1)
+    return (count - last_reset).max(axis=-1)
+
+def time_step(ds: xr.Dataset):
+    """Native time step of the dataset (None with fewer than two time steps)."""
+    if ds.sizes.get('time', 0) > 1:
+        return pd.Timedelta(ds.time.values[1] - ds.time.values[0])
+    return None
+
+def to_daily(ds: xr.Dataset) -> xr.Dataset:
+    """Daily means when the time step is shorter than a day (spells are counted in days)."""
+    step = time_step(ds)
+    if step is not None and step < pd.Timedelta(days=1):
+        return ds.resample(time='1D').mean()
+    return ds
+
+def whole_time_chunks(obj):
+    """
+    Rechunk to a single chunk along time for reductions that need every time step
+    of a cell at once (percentiles, spells). Space is split with dask's 'auto'
+    chunking so each block stays within the configured chunk size instead of
+    holding the full grid × full time span.
+    """
+    return obj.chunk({dim: -1 if dim == 'time' else 'auto' for dim in obj.dims})
+
+def get_aggregation_time(ds: xr.Dataset, type: str, threshold: float = None) -> xr.Dataset:
     """
     Get the aggregation time from the dataset. 
-    If type is 'mean', return the mean of the dataset. 
-    If type is 'sum', return the sum of the dataset.
+    If type is 'mean', 'sum', 'max' or 'min', return that reduction over time.
+    If type is 'pNN' (e.g. 'p90'), return the exact percentile (see utils.sketches
+    for the streaming approximation used on long ranges).
+    If type is 'count_gt'/'count_lt', return the number of time steps above/below threshold.
+    If type is 'spell_gt', return the longest spell of consecutive days above threshold
+    (daily or finer data only; coarser steps raise ValueError).
     """
     if type == 'mean':
         return ds.mean(dim='time')
     elif type == 'sum':
         return ds.sum(dim='time')
+    elif type == 'max':
+        return ds.max(dim='time')
+    elif type == 'min':
+        return ds.min(dim='time')
+    elif parse_percentile(type) is not None:
+        return whole_time_chunks(ds).quantile(parse_percentile(type) / 100, dim='time').drop_vars('quantile')
+    elif type in THRESHOLD_AGGREGATIONS:
+        if threshold is None:
+            raise ValueError(f"Aggregation '{type}' requires a threshold.")
+        if type == 'count_gt':
+            return (ds > threshold).where(ds.notnull()).sum(dim='time')
+        if type == 'count_lt':
+            return (ds < threshold).where(ds.notnull()).sum(dim='time')
+        step = time_step(ds)
+        if step is not None and step > pd.Timedelta(days=1):
+            # p.ej. medias mensuales: una racha de días no se puede medir
+            raise ValueError(f"'spell_gt' counts consecutive days and needs daily or finer data (time step: {step}).")
+        above = to_daily(ds) > threshold
+        if above.chunks:
+            # una racha cruza archivos: el tiempo debe ser un solo chunk (open_mfdataset da uno por archivo)
+            above = whole_time_chunks(above)
+        return xr.apply_ufunc(
+            _longest_run,
+            above,
+            input_core_dims=[['time']],
+            dask='parallelized',
+            output_dtypes=[np.int64],
+        )
     else:
-        raise ValueError("Invalid aggregation type. Use 'mean' or 'sum'.")
+        raise ValueError(f"Invalid aggregation type. Use one of {AGGREGATIONS}.")
 
 def select_dates(ds: xr.Dataset, start_date: str, end_date: str) -> xr.Dataset:
     """
@@ -30,35 +108,170 @@ def select_region(ds: xr.Dataset, lat_range: tuple, lon_range: tuple) -> xr.Data
     ds = ds.sel(lat=slice(lat_range[0], lat_range[1]), lon=slice(lon_range[0], lon_range[1]))
     return ds
 
-def get_series(ds: xr.Dataset, lat: float, lon: float) -> pd.Series:
+def domain_indexers(lat: np.ndarray, lon: np.ndarray, bbox: tuple) -> tuple:
     """
-    Get a specific series from the dataset. 
-    The series is defined by the latitude and longitude coordinates.
+    Get the lat/lon positional indexers covering a bounding box
+    (lat_min, lat_max, lon_min, lon_max) plus the box-frame longitudes.
+
+    Longitudes are measured as an offset east of lon_min modulo 360, so the same
+    box works on 0–360 and −180–180 grids and may cross the grid seam (e.g.
+    −10..10 on a 0–360 file). Latitude order (ERA5 is descending) is kept.
+    Contiguous selections are returned as slices so lazy reads stay chunk-aligned.
     """
-    layer = ds.sel(lat=lat, lon=lon, method='nearest').squeeze()
-    series = layer.to_dataframe().reset_index()
-    series.set_index('time', inplace=True)
-    return series['tp']  # Assuming 'tp' is the variable name in the dataset
+    lat_min, lat_max, lon_min, lon_max = bbox
+    lat_idx = np.nonzero((lat >= min(lat_min, lat_max)) & (lat <= max(lat_min, lat_max)))[0]
+
+    width = lon_max - lon_min
+    offset = (lon - lon_min) % 360
+    if width >= 360:
+        lon_idx = np.argsort(offset, kind="stable")
+    else:
+        lon_idx = np.nonzero(offset <= width % 360)[0]
+        lon_idx = lon_idx[np.argsort(offset[lon_idx], kind="stable")]
+    new_lon = lon_min + offset[lon_idx]
+
+    if lat_idx.size == 0 or lon_idx.size == 0:
+        raise ValueError(f"Domain {bbox} does not intersect the dataset grid")
+
+    def _as_slice(idx):
+        if np.all(np.diff(idx) == 1):
+            return slice(int(idx[0]), int(idx[-1]) + 1)
+        return idx
+
+    return _as_slice(lat_idx), _as_slice(lon_idx), new_lon
+
+def select_domain(ds: xr.Dataset, bbox: tuple,
+                  lat_key: str = 'latitude', lon_key: str = 'longitude') -> xr.Dataset:
+    """
+    Select a bounding box (lat_min, lat_max, lon_min, lon_max) by position.
+    On a lazy dataset only the chunks covering the box are read. Longitudes of
+    the result are expressed in the box's frame (e.g. −90..−30, not 270..330).
+    """
+    lat_sel, lon_sel, new_lon = domain_indexers(ds[lat_key].values, ds[lon_key].values, bbox)
+    ds = ds.isel({lat_key: lat_sel, lon_key: lon_sel})
+    return ds.assign_coords({lon_key: ds[lon_key].copy(data=new_lon)})
 
+def get_point_series(ds: xr.Dataset,
+                     start_date : str,
+                     end_date : str,
+                     points : list,
+                     source=None) -> pd.DataFrame:
+    """
+    Get the series of many (lat, lon) points at once.
+    Points are mapped to their nearest grid cell with the precomputed grid index
+    and read in a single pointwise selection; one column per point.
+    """
+    from utils.grid_index import extract_points
+
+    lats, lons = zip(*points)
+    ds = select_dates(ds, start_date, end_date)
+    var_name = list(ds.data_vars)[0]
+    values = extract_points(ds[var_name], lats, lons, source=source)
+    frame = values.transpose('time', 'point').to_pandas()
+    frame.columns = [f"{lat:.2f}, {lon:.2f}" for lat, lon in points]
+    return frame
+
+# Resoluciones temporales de salida (alias de pandas) y cómo agregar en cada período
+RESAMPLE_FREQS = {"D": "1D", "MS": "MS", "QS-DEC": "QS-DEC", "YS": "YS"}
+RESAMPLE_HOWS = ("mean", "sum", "max", "min")
+# Bloques más finos cuyos períodos forman exactamente los de cada frecuencia
+# (las estaciones DJF cruzan el año, así que no sirven para anual)
+FINER_FREQS = {"MS": ("D",), "QS-DEC": ("MS", "D"), "YS": ("MS", "D")}
+
+def period_chunks(time: pd.DatetimeIndex, freq: str) -> tuple:
+    """Time chunk sizes aligned to the resample periods (one chunk per period)."""
+    sizes = pd.Series(1, index=time).resample(RESAMPLE_FREQS[freq]).size()
+    return tuple(int(n) for n in sizes if n > 0)
+
+def resample_time(ds: xr.Dataset, freq: str, how: str = 'mean') -> xr.Dataset:
+    """
+    Resample the dataset to a coarser time step ('D', 'MS', 'QS-DEC', 'YS').
+    The time chunks are first aligned to the periods, so each period is reduced
+    inside a single chunk. Adds a 'count' variable with the time steps per period,
+    needed to combine blocks into coarser ones (see combine_blocks).
+    """
+    if how not in RESAMPLE_HOWS:
+        raise ValueError(f"Invalid resample method. Use one of {RESAMPLE_HOWS}.")
+    if ds.chunks:
+        ds = ds.chunk({'time': period_chunks(ds.time.to_index(), freq)})
+    resampled = getattr(ds.resample(time=RESAMPLE_FREQS[freq]), how)()
+    ones = xr.DataArray(np.ones(ds.sizes['time'], dtype='int32'), coords={'time': ds.time}, dims='time')
+    count = ones.resample(time=RESAMPLE_FREQS[freq]).sum()
+    return resampled.assign(count=count).sel(time=count.time[count > 0])
+
+def combine_blocks(block: xr.Dataset, freq: str, how: str = 'mean') -> xr.Dataset:
+    """
+    Combine a block aggregate (with 'count') into a coarser frequency: means are
+    weighted by the time steps of each block, sums are added and maxima maxed.
+    """
+    count = block['count']
+    values = block.drop_vars('count')
+    resampler_freq = RESAMPLE_FREQS[freq]
+    if how == 'mean':
+        combined = (values * count).resample(time=resampler_freq).sum() / count.resample(time=resampler_freq).sum()
+    else:
+        combined = getattr(values.resample(time=resampler_freq), how)()
+    new_count = count.resample(time=resampler_freq).sum()
+    return combined.assign(count=new_count).sel(time=new_count.time[new_count > 0])
+
+@traced("reduce.layer")
 def get_layer(ds: xr.Dataset, 
               start_date : str,
                 end_date : str,
-                aggregation : str = 'mean',) -> xr.Dataset:
+                aggregation : str = 'mean',
+                threshold : float = None) -> xr.Dataset:
     
 
     """
     Get a specific layer from the dataset. 
     """
     ds = select_dates(ds, start_date, end_date)
-    layer = get_aggregation_time(ds, aggregation)
+    layer = get_aggregation_time(ds, aggregation, threshold=threshold)
     return layer
 
+def get_annual_index(series: pd.DataFrame, index: str, threshold: float = None) -> pd.DataFrame:
+    """
+    Reduce a (domain-mean) series to one value per year with an ETCCDI-style
+    index: 'max', 'min', 'pNN', 'count_gt', 'count_lt' or 'spell_gt' (days).
+    """
+    series = series.select_dtypes('number')
+    groups = series.groupby(series.index.year)
+    percentile = parse_percentile(index)
+    if index in ('max', 'min', 'mean', 'sum'):
+        result = getattr(groups, index)()
+    elif percentile is not None:
+        result = groups.quantile(percentile / 100)
+    elif index in THRESHOLD_AGGREGATIONS:
+        if threshold is None:
+            raise ValueError(f"Index '{index}' requires a threshold.")
+        if index == 'count_gt':
+            result = groups.agg(lambda s: int((s > threshold).sum()))
+        elif index == 'count_lt':
+            result = groups.agg(lambda s: int((s < threshold).sum()))
+        else:
+            daily = series
+            if len(series) > 1 and series.index[1] - series.index[0] < pd.Timedelta(days=1):
+                daily = series.resample('1D').mean()
+            result = daily.groupby(daily.index.year).agg(
+                lambda s: int(_longest_run((s > threshold).to_numpy()))
+            )
+    else:
+        raise ValueError(f"Invalid index type. Use one of {AGGREGATIONS}.")
+
+    result.index = pd.to_datetime(result.index.astype(str), format='%Y')
+    result.index.name = 'time'
+    return result
+
+@traced("reduce.series")
 def get_series(ds: xr.Dataset, 
                start_date : str,
-                end_date : str) -> pd.Series:
+                end_date : str,
+                index : str = None,
+                threshold : float = None) -> pd.Series:
     
     """
     Get a specific series from the dataset.
+    If index is given, reduce it to one value per year (see get_annual_index).
     """
     ds = select_dates(ds, start_date, end_date)
     series = ds.mean(dim=['latitude', 'longitude'])
@@ -66,6 +279,8 @@ def get_series(ds: xr.Dataset,
     #series to pandas series
     series = series.to_dataframe().reset_index()
     series.set_index('time', inplace=True)
+    if index:
+        series = get_annual_index(series, index, threshold=threshold)
     return series
 
 
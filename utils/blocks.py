@@ -0,0 +1,82 @@
+"""
+Agregados por bloques temporales precalculados (diario, mensual, estacional, anual).
+
+Un bloque es el dataset completo de una fuente/variable/dominio remuestreado a
+una frecuencia con mean/sum/max, guardado en cache/blocks/. Las series y capas
+remuestreadas se sirven desde el bloque exacto o combinando uno más fino
+(p.ej. anual desde mensual), sin volver a leer los datos horarios.
+
+Precalcular un bloque:
+
+    python -m utils.blocks --source 2 --var 5 --freq MS --how mean
+"""
+import argparse
+import os
+
+import xarray as xr
+
+from utils.aggregations import FINER_FREQS, RESAMPLE_FREQS, RESAMPLE_HOWS, combine_blocks, resample_time
+from utils.storage import save_netcdf
+from utils.cache_manifest import is_valid, write_entry
+
+BLOCKS_DIR = "cache/blocks"
+
+
+def block_path(dataset_key: str, freq: str, how: str) -> str:
+    return os.path.join(BLOCKS_DIR, f"{dataset_key}_resample-{freq}_{how}.nc")
+
+def load_block(dataset_key: str, freq: str, how: str, sources: list = None):
+    """
+    Return the block aggregate at freq/how, from its own file or combined from a
+    finer cached block; None if neither is cached (and valid for the sources).
+    """
+    path = block_path(dataset_key, freq, how)
+    if is_valid(path, sources):
+        return xr.open_dataset(path)
+    for finer in FINER_FREQS.get(freq, ()):
+        path = block_path(dataset_key, finer, how)
+        if is_valid(path, sources):
+            return combine_blocks(xr.open_dataset(path), freq, how)
+    return None
+
+def build_block(ds: xr.Dataset, dataset_key: str, freq: str, how: str,
+                sources: list, variable=None) -> xr.Dataset:
+    """Compute and cache the block aggregate of the whole dataset."""
+    block = resample_time(ds, freq, how)
+    return write_entry(
+        block_path(dataset_key, freq, how),
+        lambda tmp: save_netcdf(block, tmp, variable=variable),
+        sources,
+    )
+
+def main():
+    from database.db_utils import get_available_datasets, get_variable
+    from utils.data_loader import get_file_name, get_source_paths, request_dataset
+    from utils.pipeline import stage_request
+
+    parser = argparse.ArgumentParser(description="Precompute a block aggregate")
+    parser.add_argument("--source", type=int, required=True, help="source_id")
+    parser.add_argument("--var", type=int, required=True, help="var_id")
+    parser.add_argument("--freq", choices=list(RESAMPLE_FREQS), default="MS")
+    parser.add_argument("--how", choices=RESAMPLE_HOWS, default="mean")
+    parser.add_argument("--bbox", help="lat_min,lat_max,lon_min,lon_max (por defecto global)")
+    args = parser.parse_args()
+
+    var_key = next(
+        d.variable_key for d in get_available_datasets()
+        if d.source_id == args.source and d.variable_id == args.var
+    )
+    selection = {
+        "source_id": args.source,
+        "var_id": args.var,
+        "var_key": var_key,
+        "bbox": tuple(float(v) for v in args.bbox.split(",")) if args.bbox else None,
+    }
+    request = stage_request(selection, "dataset")
+    ds = request_dataset(request)
+    block = build_block(ds, get_file_name(request), args.freq, args.how,
+                        sources=get_source_paths(request), variable=get_variable(args.var))
+    print(f"Saved {block.sizes['time']} periods to {block_path(get_file_name(request), args.freq, args.how)}")
+
+if __name__ == "__main__":
+    main()
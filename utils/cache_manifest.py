@@ -0,0 +1,210 @@
+"""
+Integridad, versionado e invalidación de la caché en disco.
+
+Cada archivo de caché tiene un sidecar ``<archivo>.meta.json`` con:
+- ``pipeline_version``: versión de los algoritmos que lo generaron,
+- ``fingerprint``: huella de los archivos fuente (nombre, tamaño, mtime),
+- ``sources``: rutas fuente usadas, ``size`` y ``checksum`` (blake2b).
+
+Al leer se valida lo barato (versión, tamaño, huella de las fuentes); el
+checksum completo solo con ``verify --deep``. Las escrituras son atómicas
+(archivo temporal + ``os.replace``), así que un proceso caído nunca deja un
+archivo truncado con nombre válido.
+
+    python -m utils.cache_manifest verify [--deep] [--workers 8]
+    python -m utils.cache_manifest gc [--deep] [--workers 8]
+"""
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+# Subir cuando cambie un algoritmo de agregación o el formato de la caché:
+# todas las entradas anteriores pasan a ser inválidas.
+PIPELINE_VERSION = "2"
+
+CACHE_ROOT = "cache"
+META_SUFFIX = ".meta.json"
+TMP_MARKER = ".tmp-"
+FINGERPRINT_TTL = 30.0      # segundos que se reutiliza la huella de una fuente
+STALE_TMP_AGE = 3600.0      # temporales más viejos que esto son restos de caídas
+
+# Capas compartidas mapeadas en memoria (utils.shared_layers): no llevan
+# manifiesto y tienen su propia limpieza, así que verify/gc no las recorren.
+SHARED_LAYERS_DIR = os.environ.get("ERA5_SHARED_LAYERS_DIR") or (
+    "/dev/shm/era5-layers" if os.path.isdir("/dev/shm") else os.path.join(CACHE_ROOT, "mmap")
+)
+
+
+def meta_path(path: str) -> str:
+    return path + META_SUFFIX
+
+def file_checksum(path: str) -> str:
+    h = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+_FINGERPRINTS = {}
+_FINGERPRINTS_LOCK = threading.Lock()
+
+def source_fingerprint(sources: list) -> str:
+    """Fingerprint of the source files (name, size and mtime of every .nc file)."""
+    h = hashlib.sha1()
+    for source in sorted(sources):
+        with _FINGERPRINTS_LOCK:
+            cached = _FINGERPRINTS.get(source)
+        if cached is not None and time.monotonic() - cached[0] < FINGERPRINT_TTL:
+            h.update(cached[1].encode())
+            continue
+
+        entries = []
+        if os.path.isdir(source):
+            for entry in os.scandir(source):
+                if entry.name.endswith(".nc"):
+                    st = entry.stat()
+                    entries.append(f"{entry.name}:{st.st_size}:{st.st_mtime_ns}")
+        elif os.path.exists(source):
+            st = os.stat(source)
+            entries.append(f"{os.path.basename(source)}:{st.st_size}:{st.st_mtime_ns}")
+        digest = hashlib.sha1("\n".join(sorted(entries)).encode()).hexdigest()
+        with _FINGERPRINTS_LOCK:
+            _FINGERPRINTS[source] = (time.monotonic(), digest)
+        h.update(digest.encode())
+    return h.hexdigest()
+
+def read_meta(path: str) -> dict:
+    try:
+        with open(meta_path(path)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def validate(path: str, sources: list = None, deep: bool = False) -> str:
+    """
+    Return None if the cache entry is valid, otherwise the reason it is not.
+    ``sources`` defaults to those recorded in the entry.
+    """
+    if not os.path.exists(path):
+        return "missing"
+    meta = read_meta(path)
+    if meta is None:
+        return "no manifest"
+    if meta.get("pipeline_version") != PIPELINE_VERSION:
+        return f"pipeline version {meta.get('pipeline_version')} != {PIPELINE_VERSION}"
+    if os.path.getsize(path) != meta.get("size"):
+        return "size mismatch (truncated or rewritten)"
+    if sources is None:
+        sources = meta.get("sources", [])
+    if meta.get("fingerprint") != source_fingerprint(sources):
+        return "source files changed"
+    if deep and file_checksum(path) != meta.get("checksum"):
+        return "checksum mismatch"
+    return None
+
+def is_valid(path: str, sources: list = None) -> bool:
+    """Cheap validation used on every cache read."""
+    return validate(path, sources) is None
+
+def write_entry(path: str, writer, sources: list):
+    """
+    Write a cache entry atomically: ``writer(tmp_path)`` writes the data, which is
+    then moved into place, followed by its manifest. Returns writer's result.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}{TMP_MARKER}{os.getpid()}-{threading.get_ident()}"
+    try:
+        result = writer(tmp)
+        meta = {
+            "pipeline_version": PIPELINE_VERSION,
+            "fingerprint": source_fingerprint(sources),
+            "sources": sorted(sources),
+            "size": os.path.getsize(tmp),
+            "checksum": file_checksum(tmp),
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+        }
+        # el manifiesto viejo se quita antes de reemplazar los datos, así nunca
+        # queda un manifiesto válido apuntando a datos distintos
+        if os.path.exists(meta_path(path)):
+            os.remove(meta_path(path))
+        os.replace(tmp, path)
+        with open(meta_path(path) + TMP_MARKER, "w") as f:
+            json.dump(meta, f)
+        os.replace(meta_path(path) + TMP_MARKER, meta_path(path))
+        return result
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+# --------------------------------------------------------------------------- #
+#                             verify / gc                                     #
+# --------------------------------------------------------------------------- #
+def scan(root: str = CACHE_ROOT) -> tuple:
+    """Return (entries, orphan manifests, leftover temporaries) under root."""
+    entries, orphans, temporaries = [], [], []
+    shared = os.path.abspath(SHARED_LAYERS_DIR)
+    for dirpath, dirnames, filenames in os.walk(root):
+        if os.path.abspath(dirpath) == shared:
+            dirnames[:] = []
+            continue
+        names = set(filenames)
+        for name in filenames:
+            full = os.path.join(dirpath, name)
+            if TMP_MARKER in name:
+                temporaries.append(full)
+            elif name.endswith(META_SUFFIX):
+                if name[:-len(META_SUFFIX)] not in names:
+                    orphans.append(full)
+            else:
+                entries.append(full)
+    return entries, orphans, temporaries
+
+def _remove(path: str):
+    for p in (path, meta_path(path)):
+        if os.path.exists(p):
+            os.remove(p)
+
+def run(command: str, root: str = CACHE_ROOT, deep: bool = False, workers: int = 8) -> dict:
+    """Verify every cache entry in parallel; with command 'gc' also delete invalid
+    entries, orphan manifests and stale temporaries so they are recomputed."""
+    entries, orphans, temporaries = scan(root)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        reasons = dict(zip(entries, pool.map(lambda p: validate(p, deep=deep), entries)))
+    invalid = {p: r for p, r in reasons.items() if r is not None}
+    stale_tmp = [p for p in temporaries if time.time() - os.path.getmtime(p) > STALE_TMP_AGE]
+
+    for path, reason in sorted(invalid.items()):
+        print(f"INVALID {path}: {reason}")
+    if command == "gc":
+        for path in invalid:
+            _remove(path)
+        for path in orphans + stale_tmp:
+            os.remove(path)
+
+    return {
+        "entries": len(entries),
+        "valid": len(entries) - len(invalid),
+        "invalid": len(invalid),
+        "orphan_manifests": len(orphans),
+        "stale_temporaries": len(stale_tmp),
+        "removed": len(invalid) + len(orphans) + len(stale_tmp) if command == "gc" else 0,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Verify or garbage-collect the on-disk cache")
+    parser.add_argument("command", choices=["verify", "gc"])
+    parser.add_argument("--root", default=CACHE_ROOT)
+    parser.add_argument("--deep", action="store_true", help="Also verify full-file checksums")
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+    print(json.dumps(run(args.command, args.root, args.deep, args.workers), indent=2))
+
+if __name__ == "__main__":
+    main()
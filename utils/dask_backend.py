@@ -0,0 +1,151 @@
+"""
+Backend de ejecución de Dask para la ruta de datos.
+
+Se crea una sola vez por proceso (servidor) y lo comparten todas las sesiones.
+Se configura con variables de entorno:
+
+    ERA5_DASK_BACKEND        threads (defecto) | processes | sync
+    ERA5_DASK_WORKERS        nº de hilos / procesos (defecto: CPUs)
+    ERA5_DASK_MEMORY_LIMIT   límite por worker en 'processes' (p.ej. "2GiB")
+
+- ``threads``: scheduler de hilos local, con un nº de hilos acotado.
+- ``processes``: ``dask.distributed.LocalCluster`` con workers en procesos
+  separados: la decodificación de NetCDF no compite por el GIL con la UI.
+  Sin dashboard; las métricas se leen con ``get_metrics()``.
+- ``sync``: todo en el hilo que llama (tests, depuración).
+"""
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+import dask
+from dask.callbacks import Callback
+
+BACKENDS = ("threads", "processes", "sync")
+
+
+@dataclass
+class BackendConfig:
+    backend: str = "threads"
+    n_workers: Optional[int] = None
+    memory_limit: str = "auto"
+
+    @classmethod
+    def from_env(cls) -> "BackendConfig":
+        backend = os.environ.get("ERA5_DASK_BACKEND", "threads").lower()
+        if backend not in BACKENDS:
+            raise ValueError(f"Invalid ERA5_DASK_BACKEND '{backend}'. Use one of {BACKENDS}.")
+        n_workers = os.environ.get("ERA5_DASK_WORKERS")
+        return cls(
+            backend=backend,
+            n_workers=int(n_workers) if n_workers else None,
+            memory_limit=os.environ.get("ERA5_DASK_MEMORY_LIMIT", "auto"),
+        )
+
+
+class _TaskCounter(Callback):
+    """Counts finished tasks for the local (threads/sync) schedulers."""
+
+    def __init__(self):
+        super().__init__()
+        self.completed = 0
+
+    def _posttask(self, key, result, dsk, state, id):
+        self.completed += 1
+
+
+@dataclass
+class Backend:
+    config: BackendConfig
+    started: float = field(default_factory=time.time)
+    client: object = None
+    cluster: object = None
+    counter: object = None
+
+    @property
+    def parallel(self) -> bool:
+        """Whether file opening/decoding may run in parallel (False for sync)."""
+        return self.config.backend != "sync"
+
+
+_BACKEND = None
+_BACKEND_LOCK = threading.Lock()
+
+def _start(config: BackendConfig) -> Backend:
+    backend = Backend(config)
+    if config.backend == "processes":
+        from dask.distributed import Client, LocalCluster
+        from distributed.diagnostics.plugin import SchedulerPlugin
+
+        class _SchedulerTaskCounter(SchedulerPlugin):
+            name = "era5-task-counter"
+
+            def __init__(self):
+                self.completed = 0
+
+            def transition(self, key, start, finish, *args, **kwargs):
+                if finish == "memory":
+                    self.completed += 1
+
+        backend.cluster = LocalCluster(
+            n_workers=config.n_workers,
+            threads_per_worker=1,
+            processes=True,
+            memory_limit=config.memory_limit,
+            dashboard_address=None,
+        )
+        # El scheduler de LocalCluster vive en este proceso: el plugin se
+        # registra directamente, sin serializarlo.
+        backend.counter = _SchedulerTaskCounter()
+        backend.cluster.scheduler.add_plugin(backend.counter)
+        backend.client = Client(backend.cluster, set_as_default=True)
+    else:
+        scheduler = "synchronous" if config.backend == "sync" else "threads"
+        options = {"scheduler": scheduler}
+        if config.n_workers:
+            options["num_workers"] = config.n_workers
+        dask.config.set(options)
+        backend.counter = _TaskCounter()
+        backend.counter.register()
+    print(f"Dask backend started: {config}")
+    return backend
+
+def get_backend() -> Backend:
+    """Return the process-wide Dask backend, starting it on first use."""
+    global _BACKEND
+    with _BACKEND_LOCK:
+        if _BACKEND is None:
+            _BACKEND = _start(BackendConfig.from_env())
+        return _BACKEND
+
+def _worker_spill(dask_worker) -> dict:
+    """Runs on each worker: bytes in memory and spilled to disk."""
+    fast = getattr(dask_worker.data, "fast", None)
+    spilled = getattr(dask_worker.data, "spilled_total", None)
+    return {
+        "memory_bytes": int(getattr(fast, "total_weight", 0)),
+        "spilled_bytes": int(spilled.disk) if spilled is not None else 0,
+    }
+
+def get_metrics() -> dict:
+    """
+    Métricas del backend sin dashboard: tareas completadas, throughput medio
+    (tareas/s desde el arranque) y, con LocalCluster, memoria y spill por worker.
+    """
+    backend = get_backend()
+    uptime = time.time() - backend.started
+    completed = backend.counter.completed if backend.counter is not None else 0
+    metrics = {
+        "backend": backend.config.backend,
+        "uptime_s": round(uptime, 1),
+        "tasks_completed": completed,
+        "tasks_per_s": round(completed / uptime, 2) if uptime > 0 else 0.0,
+    }
+    if backend.client is not None:
+        workers = backend.client.run(_worker_spill)
+        metrics["workers"] = len(workers)
+        metrics["memory_bytes"] = sum(w["memory_bytes"] for w in workers.values())
+        metrics["spilled_bytes"] = sum(w["spilled_bytes"] for w in workers.values())
+    return metrics
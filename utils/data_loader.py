@@ -1,17 +1,31 @@
+import dask
 import xarray as xr
 import pandas as pd
 import os
 import json
+import threading
+from collections import OrderedDict
 from pathlib import Path
-from utils.aggregations import get_layer, get_series
-from database.db_utils import get_path
+from utils.aggregations import RESAMPLE_FREQS, get_layer, get_series, get_point_series, select_domain, select_dates, parse_percentile, resample_time
+from utils import blocks, frames, shared_layers, sketches
+from utils.pipeline import stage_request
+from utils.dask_backend import get_backend
+from utils.storage import save_netcdf
+from utils.cache_manifest import is_valid, source_fingerprint, write_entry
+from utils.tracing import span
+from utils.regrid import regrid
+from utils.expressions import build_derived_dataset, formula_inputs
+from database.db_utils import get_path, get_source, get_variable, get_source_datasets
 
 def get_file_name(request: dict) -> str:
     """Generate a str with any keys from the request dictionary."""
     # Sort dictionary keys to ensure consistent naming
     sorted_items = sorted(request.items())
-    # Create a string joining key-value pairs
-    return "_".join([f"{k}-{v}" for k, v in sorted_items])
+    # Create a string joining key-value pairs (tuples such as bbox joined with ',')
+    return "_".join([
+        f"{k}-{','.join(map(str, v)) if isinstance(v, (tuple, list)) else v}"
+        for k, v in sorted_items
+    ])
 
 def load_dataset(path: str) -> xr.Dataset:
     """Load a dataset from a given path. Get all nc file names in path, sort by date in name and concatenate with xarray"""
@@ -35,11 +49,14 @@ def load_dataset(path: str) -> xr.Dataset:
     return xr.concat(datasets, dim='time')
 
 
-def load_dataset_lazy(path, chunks={"time": -1}):
+def load_dataset_lazy(path, chunks={"time": -1}, bbox=None,
+                      lat_key='latitude', lon_key='longitude'):
     """
     Carga perezosa usando Dask para no saturar RAM.
     - Agrupa todos los .nc en la carpeta.
     - Renombra/ajusta coordenadas en un preprocess.
+    - Si se pasa bbox (lat_min, lat_max, lon_min, lon_max) recorta cada archivo
+      por posición antes de combinar: solo se leen los chunks del dominio.
     """
     pattern = os.path.join(path, "*.nc")
 
@@ -48,92 +65,357 @@ def load_dataset_lazy(path, chunks={"time": -1}):
         if 'valid_time' in ds.coords:
             ds = ds.rename({"valid_time": "time"})
 
+        if bbox is not None:
+            ds = select_domain(ds, bbox, lat_key=lat_key, lon_key=lon_key)
+
         return ds
 
-    return xr.open_mfdataset(
-        pattern,
-        combine="by_coords",   # concat + merge automático
-        parallel=True,         # usa threads/processes de Dask
-        chunks=chunks,         # activa loading perezoso
-        preprocess=_preprocess
-    )
+    with span("load", path=path, bbox=bbox) as s:
+        return s.record(xr.open_mfdataset(
+            pattern,
+            combine="by_coords",   # concat + merge automático
+            parallel=get_backend().parallel,  # usa el backend de Dask compartido
+            chunks=chunks,         # activa loading perezoso
+            preprocess=_preprocess
+        ))
+
+CACHE_EXTENSIONS = {"layers": ".nc", "series": ".csv", "frames": ".npz"}
+
+def get_cache_path(kind: str, request: dict) -> str:
+    """Cache file of a request in cache/<kind>/ (the directory is created if needed)."""
+    cache_dir = os.path.join("cache", kind)
+    os.makedirs(cache_dir, exist_ok=True)
+    return os.path.join(cache_dir, get_file_name(request) + CACHE_EXTENSIONS[kind])
+
+def check_cache(path: str, sources: list = None) -> bool:
+    """Check if a valid entry is cached: it exists, was written completely by the
+    current pipeline version and its source files have not changed since."""
+    return is_valid(path, sources)
+
+def get_source_paths(request: dict) -> list:
+    """Source directories a request reads (the inputs of a derived variable)."""
+    variable = get_variable(request['var_id'])
+    if variable is not None and variable.formula:
+        paths = get_source_datasets(request['source_id'])
+        return [paths[k] for k in formula_inputs(variable.formula) if k in paths]
+    return [get_path(request['source_id'], request['var_id'])]
+
+def dataset_version(request: dict) -> str:
+    """Fingerprint of the source files of a dataset request: changes when a file is
+    added or rewritten, so the dataset stage (and everything built on it) is redone."""
+    return source_fingerprint(get_source_paths(request))
 
-def check_cache(path: str) -> bool:
-    """Check if the dataset is already cached. If it is, return True."""
-    return os.path.exists(path)
+# Handles perezosos abiertos una vez por proceso y compartidos por todas las
+# sesiones de Streamlit (el módulo sobrevive a los reruns del script).
+# (path, bbox) -> (huella de los archivos fuente, dataset), del menos al más
+# recientemente usado: con dominios libres cada posición de los sliders es un
+# handle distinto, así que se guardan como mucho MAX_DATASET_HANDLES.
+MAX_DATASET_HANDLES = int(os.environ.get("ERA5_MAX_DATASET_HANDLES", "8"))
+_DATASET_HANDLES = OrderedDict()
+_DATASET_HANDLES_LOCK = threading.Lock()
+
+def open_source_dataset(path: str, bbox: tuple = None,
+                        lat_key: str = 'latitude', lon_key: str = 'longitude') -> xr.Dataset:
+    """Return the warm lazy dataset handle for a source path and domain, opening it on
+    first use and reopening it when the source files changed (new or rewritten .nc)."""
+    key = (path, tuple(bbox) if bbox is not None else None)
+    fingerprint = source_fingerprint([path])
+    with _DATASET_HANDLES_LOCK:
+        cached = _DATASET_HANDLES.get(key)
+        if cached is not None and cached[0] == fingerprint:
+            _DATASET_HANDLES.move_to_end(key)
+            return cached[1]
+        print(f"Opening dataset handle for {path} (domain {bbox})...")
+        ds = load_dataset_lazy(path, bbox=bbox, lat_key=lat_key, lon_key=lon_key)
+        _DATASET_HANDLES[key] = (fingerprint, ds)
+        _DATASET_HANDLES.move_to_end(key)
+        while len(_DATASET_HANDLES) > MAX_DATASET_HANDLES:
+            _DATASET_HANDLES.popitem(last=False)
+        return ds
+
+def request_derived_dataset(request: dict, variable, source) -> xr.Dataset:
+    """Build the lazy dataset of a derived variable (variables.formula) from the
+    warm handles of its inputs, so all of them are read in a single pass."""
+    paths = get_source_datasets(request['source_id'])
+    inputs = {}
+    for key in formula_inputs(variable.formula):
+        if key not in paths:
+            raise ValueError(f"Variable '{key}' used by '{variable.name}' is not available for this source")
+        inputs[key] = open_source_dataset(
+            paths[key],
+            bbox=request.get('bbox'),
+            lat_key=source.lat_key or 'latitude',
+            lon_key=source.lon_key or 'longitude',
+        )
+    return build_derived_dataset(
+        variable.formula,
+        inputs,
+        name=request.get('var_key') or f"var_{variable.id}",
+        units=variable.unit or "",
+    )
 
 def request_dataset(request: dict) -> xr.Dataset:
-    """Request a dataset from the database. First check if dataset is cached. if it is, load it from cache. 
-    If not, load it from the database and save on cache/datasets/ with the name of the request. Then return the dataset."""
+    """Request a dataset from the database. Returns the shared lazy handle for the
+    source files, so only the metadata is read here; the data itself is read by the
+    layer and series reductions. Derived variables return their lazy expression."""
+    source = get_source(request['source_id'])
+    variable = get_variable(request['var_id'])
+    if variable is not None and variable.formula:
+        return request_derived_dataset(request, variable, source)
+
     # Get database path for the dataset
     db_path = get_path(request['source_id'], request['var_id'])
     if not db_path:
         raise ValueError("Dataset not found in database")
-    
-    # Generate cache filename
-    cache_dir = "cache/datasets"
-    os.makedirs(cache_dir, exist_ok=True)
-    cache_filename = get_file_name(request) + ".nc"
-    print(f"Cache filename: {cache_filename}")
-    cache_path = os.path.join(cache_dir, cache_filename)
-    
-    # Check cache
-    if check_cache(cache_path):
-        return xr.open_dataset(cache_path)
-    
-    print(f"Loading dataset from {db_path}...")
-    # Load dataset from source
-    ds = load_dataset_lazy(db_path)
+
+    ds = open_source_dataset(
+        db_path,
+        bbox=request.get('bbox'),
+        lat_key=source.lat_key or 'latitude',
+        lon_key=source.lon_key or 'longitude',
+    )
     print(f"Loaded dataset with {len(ds.time)} time steps")
-    # Save to cache
-    ds.to_netcdf(cache_path)
-    
     return ds
 
 def request_layer(ds: xr.Dataset, request: dict) -> xr.Dataset:
     """Request a specific layer from the dataset. First check if layer is cached. if it is, load it from cache. 
     If not, get from aggregations.get_layer and save on cache/layers/ with the name of the request. Then return the layer."""
     # Generate cache filename
-    cache_dir = "cache/layers"
-    os.makedirs(cache_dir, exist_ok=True)
-    cache_filename = get_file_name(request) + ".nc"
-    cache_path = os.path.join(cache_dir, cache_filename)
+    cache_path = get_cache_path("layers", request)
     
-    # Check cache
-    if check_cache(cache_path):
-        return xr.open_dataset(cache_path)
+    # Check cache: primero la copia compartida entre procesos (memmap), luego el disco
+    sources = get_source_paths(request)
+    key = get_file_name(request)
+    layer = shared_layers.open_layer(key, sources)
+    if layer is not None:
+        return layer
+    if check_cache(cache_path, sources):
+        return share_layer(xr.open_dataset(cache_path), key, sources)
     
-    # Get layer from dataset
-    layer = get_layer(
-        ds,
-        start_date=request['start_date'],
-        end_date=request['end_date'],
-        aggregation=request.get('aggregation', 'mean')
-    )
+    # Get layer from dataset (percentiles from the mergeable yearly sketches)
+    aggregation = request.get('agg', 'mean')
+    if request.get('resample'):
+        # p.ej. media de los máximos anuales: agregación sobre los períodos remuestreados
+        layer = get_layer(
+            get_resampled(ds, request),
+            start_date=request['start_date'],
+            end_date=request['end_date'],
+            aggregation=aggregation,
+            threshold=request.get('threshold'),
+        )
+    elif parse_percentile(aggregation) is not None:
+        layer = request_percentile_layer(ds, request, parse_percentile(aggregation) / 100)
+    else:
+        layer = get_layer(
+            ds,
+            start_date=request['start_date'],
+            end_date=request['end_date'],
+            aggregation=aggregation,
+            threshold=request.get('threshold'),
+        )
     
-    # Save to cache
-    layer.to_netcdf(cache_path)
+    # Save to cache (float32 / int16 empaquetado según la variable, comprimido)
+    variable = get_variable(request['var_id'])
+    layer = write_entry(cache_path, lambda tmp: save_netcdf(layer, tmp, variable=variable), sources)
     
+    return share_layer(layer, key, sources)
+
+def share_layer(layer: xr.Dataset, key: str, sources: list) -> xr.Dataset:
+    """Publish a layer to the shared store and return its memory-mapped view
+    (so this process does not keep a private copy); the layer itself if it cannot be shared."""
+    if shared_layers.publish(layer, key, sources):
+        shared = shared_layers.open_layer(key, sources)
+        if shared is not None:
+            return shared
     return layer
 
-def request_series(ds: xr.Dataset, request: dict) -> pd.Series:
+def _write_json(data: dict, path: str) -> dict:
+    with open(path, "w") as f:
+        json.dump(data, f)
+    return data
+
+def get_sketch_edges(ds: xr.Dataset, dataset_key: str, sources: list):
+    """Shared histogram bin edges for a dataset (from its full-range min/max),
+    computed once and stored in cache/sketches/ so every block sketch is mergeable."""
+    cache_dir = "cache/sketches"
+    os.makedirs(cache_dir, exist_ok=True)
+    edges_path = os.path.join(cache_dir, dataset_key + "_edges.json")
+    if check_cache(edges_path, sources):
+        with open(edges_path) as f:
+            meta = json.load(f)
+    else:
+        da = ds[list(ds.data_vars)[0]]
+        # una sola pasada sobre los datos para ambos extremos
+        vmin, vmax = dask.compute(da.min(), da.max())
+        meta = {"vmin": float(vmin), "vmax": float(vmax), "n_bins": sketches.N_BINS}
+        write_entry(edges_path, lambda tmp: _write_json(meta, tmp), sources)
+    return sketches.get_edges(meta["vmin"], meta["vmax"], meta["n_bins"])
+
+def request_percentile_layer(ds: xr.Dataset, request: dict, q: float) -> xr.Dataset:
+    """Approximate percentile layer from per-cell histogram sketches. Sketches of
+    whole years are cached in cache/sketches/ and merged with those of the partial
+    years at the ends of the range, so new ranges only read the uncached years."""
+    dataset_key = get_file_name(stage_request(request, 'dataset'))
+    sources = get_source_paths(request)
+    edges = get_sketch_edges(ds, dataset_key, sources)
+    var_name = list(ds.data_vars)[0]
+    start, end = pd.Timestamp(request['start_date']), pd.Timestamp(request['end_date'])
+
+    block_sketches = []
+    for year in range(start.year, end.year + 1):
+        year_start, year_end = pd.Timestamp(year, 1, 1), pd.Timestamp(year, 12, 31)
+        block_start, block_end = max(start, year_start), min(end, year_end)
+        block = select_dates(ds[var_name], block_start.strftime('%Y-%m-%d'), block_end.strftime('%Y-%m-%d'))
+        if block.sizes['time'] == 0:
+            continue
+        if (block_start, block_end) != (year_start, year_end):
+            block_sketches.append(sketches.sketch(block, edges))
+            continue
+
+        block_path = os.path.join("cache/sketches", f"{dataset_key}_{year}.nc")
+        if check_cache(block_path, sources):
+            block_sketches.append(xr.open_dataset(block_path)['counts'])
+        else:
+            counts = sketches.sketch(block, edges).rename('counts')
+            counts = write_entry(block_path, lambda tmp: save_netcdf(counts, tmp), sources)
+            block_sketches.append(counts['counts'])
+
+    if not block_sketches:
+        raise ValueError("No data in the selected date range")
+    layer = sketches.quantile(sketches.merge(block_sketches), edges, q)
+    return layer.rename(var_name).to_dataset()
+
+def _resample_span(ds: xr.Dataset, start: pd.Timestamp, stop: pd.Timestamp, freq: str, how: str):
+    """Resample the time steps in [start, stop); None if there are none."""
+    part = ds.sel(time=slice(start, stop - pd.Timedelta(1, 'ns')))
+    return resample_time(part, freq, how) if part.sizes['time'] else None
+
+def get_resampled(ds: xr.Dataset, request: dict) -> xr.Dataset:
+    """Dataset resampled to request['resample'] with request['resample_how'] over the
+    date range. The whole periods inside the range come from the cached block
+    aggregate (exact or combined from a finer one) when available; partial periods
+    at the ends (e.g. 2000 from 2000-06-01) are resampled from the dataset itself,
+    so the result is the same with or without a cached block."""
+    freq, how = request['resample'], request.get('resample_how') or 'mean'
+    start = pd.Timestamp(request['start_date'])
+    stop = pd.Timestamp(request['end_date']) + pd.Timedelta(days=1)   # end_date inclusive
+    boundaries = pd.date_range(start, stop, freq=RESAMPLE_FREQS[freq])
+
+    block = None
+    if len(boundaries) > 1:
+        block = blocks.load_block(get_file_name(stage_request(request, 'dataset')), freq, how,
+                                  sources=get_source_paths(request))
+    if block is None:
+        parts = [_resample_span(ds, start, stop, freq, how)]
+    else:
+        first, last = boundaries[0], boundaries[-1]
+        parts = [
+            _resample_span(ds, start, first, freq, how),
+            block.sel(time=slice(first, last - pd.Timedelta(1, 'ns'))),
+            _resample_span(ds, last, stop, freq, how),
+        ]
+    parts = [p for p in parts if p is not None]
+    if not parts:
+        raise ValueError("No data in the selected date range")
+
+    resampled = xr.concat(parts, dim='time').drop_vars('count')
+    # un primer período parcial se etiqueta con start_date (no con el inicio del
+    # período), así el select_dates de get_layer/get_series no lo descarta
+    times = resampled.time.to_index()
+    return resampled.assign_coords(time=times.where(times >= start, start))
+
+def request_frames(ds: xr.Dataset, request: dict) -> dict:
+    """Request the preencoded monthly frames of the date range for the time slider
+    (see utils.frames). All months come from one grouped reduction (or a cached
+    monthly block) reduced with the selected aggregation; the uint8 frames are cached
+    in cache/frames/. Returns None unless request['animate'] is set and the
+    aggregation can be shown month by month (frames.FRAME_AGGREGATIONS)."""
+    how = request.get('agg') or 'mean'
+    if not request.get('animate') or how not in frames.FRAME_AGGREGATIONS:
+        return None
+
+    cache_path = get_cache_path("frames", request)
+    sources = get_source_paths(request)
+    if check_cache(cache_path, sources):
+        return frames.load_frames(cache_path)
+
+    monthly = get_resampled(ds, {**request, 'resample': 'MS', 'resample_how': how})
+    encoded = frames.encode_frames(monthly[list(monthly.data_vars)[0]])
+    return write_entry(cache_path, lambda tmp: frames.save_frames(encoded, tmp), sources)
+
+def request_series(ds: xr.Dataset, request: dict) -> pd.DataFrame:
     """Request a specific series from the dataset. First check if series is cached. if it is, load it from cache. 
     If not, get from aggregations.get_series and save on cache/series/ with the name of the request. Then return the series."""
     # Generate cache filename
-    cache_dir = "cache/series"
-    os.makedirs(cache_dir, exist_ok=True)
-    cache_filename = get_file_name(request) + ".csv"
-    cache_path = os.path.join(cache_dir, cache_filename)
+    cache_path = get_cache_path("series", request)
     
     # Check cache
-    if check_cache(cache_path):
-        return pd.read_csv(cache_path, index_col='time', parse_dates=True)['value']
+    sources = get_source_paths(request)
+    if check_cache(cache_path, sources):
+        return pd.read_csv(cache_path, index_col='time', parse_dates=True)
     
-    # Get series from dataset
+    # Get series from dataset (or from its resampled blocks)
     series = get_series(
-        ds,
+        get_resampled(ds, request) if request.get('resample') else ds,
         start_date=request['start_date'],
         end_date=request['end_date'],
+        index=request.get('series_index'),
+        threshold=request.get('threshold'),
     )
+
+    # Save to cache
+    write_entry(cache_path, series.to_csv, sources)
     
-    return series
\ No newline at end of file
+    return series
+
+def request_point_series(ds: xr.Dataset, request: dict) -> pd.DataFrame:
+    """Request the series of the points in request['points'] (clicked on the map or
+    supplied in batch). Returns None when there are no points."""
+    points = request.get('points')
+    if not points:
+        return None
+
+    return get_point_series(
+        ds,
+        start_date=request['start_date'],
+        end_date=request['end_date'],
+        points=list(points),
+        source=get_source(request['source_id']),
+    )
+
+def request_comparison(layer: xr.Dataset, series: pd.DataFrame, request: dict) -> dict:
+    """Compare the selected source with request['compare'] = (source_id, var_id,
+    var_key, method). The other source's layer and series are requested (and cached)
+    as usual; its layer is regridded onto this layer's grid with cached sparse
+    weights. Returns the difference layer, both series and their correlation."""
+    compare = request.get('compare')
+    if not compare:
+        return None
+
+    source_id, var_id, var_key, method = compare
+    other = {**request, 'source_id': source_id, 'var_id': var_id, 'var_key': var_key}
+    ds_other = request_dataset(stage_request(other, 'dataset'))
+    layer_other = request_layer(ds_other, stage_request(other, 'layer'))
+    series_other = request_series(ds_other, stage_request(other, 'series'))
+
+    var_name = list(layer.data_vars)[0]
+    other_name = list(layer_other.data_vars)[0]
+    layer_other = regrid(
+        layer_other[[other_name]].rename({other_name: var_name}),
+        layer,
+        method=method,
+        sources=get_source_paths(request) + get_source_paths(other),
+    )
+    difference = layer[[var_name]] - layer_other
+
+    both = pd.concat(
+        [series.select_dtypes('number').iloc[:, 0].rename(f"{request['source_id']}:{request['var_key']}"),
+         series_other.select_dtypes('number').iloc[:, 0].rename(f"{source_id}:{var_key}")],
+        axis=1,
+        join='inner',
+    )
+    return {
+        "difference": difference,
+        "series": both,
+        "correlation": float(both.iloc[:, 0].corr(both.iloc[:, 1])),
+    }
@@ -0,0 +1,72 @@
+"""
+Fotogramas preencodificados para el modo animación (slider temporal).
+
+Todas las capas mensuales del rango se calculan en una sola reducción
+agrupada (ver ``aggregations.resample_time``), se reducen espacialmente a un
+máximo de celdas por fotograma y se cuantizan a uint8 contra un rango de
+color común: 0..254 son valores, 255 es "sin dato". Así cada fotograma pesa
+un byte por celda y el navegador puede recorrerlos sin volver al servidor.
+"""
+import numpy as np
+import xarray as xr
+
+from utils.grid_index import get_coord_names
+
+# Agregaciones que se pueden mostrar mes a mes (reducción mensual con el mismo
+# nombre); percentiles y conteos/rachas sobre umbral no se animan.
+FRAME_AGGREGATIONS = ("mean", "sum", "max", "min")
+
+NODATA = 255
+LEVELS = 254              # valores útiles: 0..254
+MAX_FRAME_CELLS = 40_000
+
+
+def coarsen_to(da: xr.DataArray, max_cells: int = MAX_FRAME_CELLS) -> xr.DataArray:
+    """Block-average the spatial dims so each frame has at most max_cells cells."""
+    lat_name, lon_name = get_coord_names(da)
+    total = da.sizes[lat_name] * da.sizes[lon_name]
+    factor = int(np.ceil(np.sqrt(total / max_cells)))
+    if factor > 1:
+        da = da.coarsen({lat_name: factor, lon_name: factor}, boundary="trim").mean()
+    return da
+
+def encode_frames(da: xr.DataArray, max_cells: int = MAX_FRAME_CELLS) -> dict:
+    """
+    Quantize a (time, lat, lon) DataArray into uint8 frames with a shared range.
+    Returns frames, lat, lon, labels, vmin, vmax and the quantization step.
+    """
+    lat_name, lon_name = get_coord_names(da)
+    da = coarsen_to(da, max_cells).transpose("time", lat_name, lon_name)
+    values = np.asarray(da.values, dtype="float64")
+
+    finite = np.isfinite(values)
+    if finite.any():
+        vmin, vmax = float(np.nanmin(values)), float(np.nanmax(values))
+    else:
+        vmin, vmax = 0.0, 1.0
+    step = (vmax - vmin) / LEVELS if vmax > vmin else 1.0
+
+    frames = np.full(values.shape, NODATA, dtype="uint8")
+    frames[finite] = np.clip(np.rint((values[finite] - vmin) / step), 0, LEVELS).astype("uint8")
+    return {
+        "frames": frames,
+        "lat": da[lat_name].values,
+        "lon": da[lon_name].values,
+        "labels": np.array([str(t)[:7] for t in da["time"].values]),
+        "vmin": vmin,
+        "vmax": vmax,
+        "step": step,
+    }
+
+def save_frames(encoded: dict, path: str) -> dict:
+    # se pasa un objeto archivo para que numpy no añada ".npz" a la ruta temporal
+    with open(path, "wb") as f:
+        np.savez_compressed(f, **encoded)
+    return encoded
+
+def load_frames(path: str) -> dict:
+    with np.load(path) as data:
+        encoded = {key: data[key] for key in data.files}
+    for key in ("vmin", "vmax", "step"):
+        encoded[key] = float(encoded[key])
+    return encoded
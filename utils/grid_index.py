@@ -0,0 +1,149 @@
+"""
+Índice de punto de grilla más cercano, precalculado por fuente.
+
+Convierte muchos puntos (lat, lon) en índices de celda en una sola llamada
+vectorizada:
+- grillas regulares 1D: aritmética directa (sin búsquedas),
+- grillas 1D irregulares: ``searchsorted`` sobre las coordenadas ordenadas,
+- grillas proyectadas (``x_key``/``y_key`` con lat/lon 2D): KD-tree sobre la
+  esfera unitaria (requiere scipy).
+"""
+import threading
+
+import numpy as np
+import xarray as xr
+
+
+def _is_regular(values: np.ndarray) -> bool:
+    if values.size < 2:
+        return False
+    step = np.diff(values)
+    return bool(np.allclose(step, step[0], rtol=1e-6, atol=1e-9))
+
+def _to_xyz(lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+    lat, lon = np.deg2rad(lat), np.deg2rad(lon)
+    return np.stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)], axis=-1)
+
+
+class _Axis:
+    """Nearest-index lookup along one 1D coordinate."""
+
+    def __init__(self, values: np.ndarray, periodic: bool = False):
+        values = np.asarray(values, dtype="float64")
+        self.size = values.size
+        self.periodic = periodic
+        self.regular = _is_regular(values)
+        if self.regular:
+            self.start = values[0]
+            self.step = values[1] - values[0]
+            self.span = abs(self.step) * self.size
+        else:
+            self.order = np.argsort(values)
+            self.sorted = values[self.order]
+
+    def query(self, q: np.ndarray) -> np.ndarray:
+        q = np.asarray(q, dtype="float64")
+        if not self.regular:
+            if self.periodic:
+                # llevar los puntos al marco de la coordenada
+                q = self.sorted[0] + (q - self.sorted[0]) % 360
+            pos = np.clip(np.searchsorted(self.sorted, q), 1, self.size - 1)
+            left, right = self.sorted[pos - 1], self.sorted[pos]
+            pos = np.where(q - left <= right - q, pos - 1, pos)
+            return self.order[pos]
+
+        if self.periodic:
+            offset = (q - self.start) % 360 if self.step > 0 else (self.start - q) % 360
+            if self.span >= 360 - 1e-6:
+                return np.rint(offset / abs(self.step)).astype("int64") % self.size
+            # dominio regional: los puntos al oeste del borde quedan en negativo
+            offset = np.where(offset > (self.span + 360) / 2, offset - 360, offset)
+            return np.clip(np.rint(offset / abs(self.step)), 0, self.size - 1).astype("int64")
+
+        idx = np.rint((q - self.start) / self.step)
+        return np.clip(idx, 0, self.size - 1).astype("int64")
+
+
+class GridIndex:
+    """
+    Nearest-grid-point index for a dataset grid.
+
+    ``query(lats, lons)`` returns a dict ``{dim: indices}`` ready for a
+    pointwise ``isel`` (see ``extract_points``).
+    """
+
+    def __init__(self, lat: xr.DataArray, lon: xr.DataArray):
+        if lat.ndim == 1 and lon.ndim == 1:
+            self.kind = "regular" if _is_regular(lat.values) and _is_regular(lon.values) else "rectilinear"
+            self.dims = (lat.dims[0], lon.dims[0])
+            self._lat = _Axis(lat.values)
+            self._lon = _Axis(lon.values, periodic=True)
+        else:
+            from scipy.spatial import cKDTree
+
+            self.kind = "curvilinear"
+            self.dims = lat.dims
+            self.shape = lat.shape
+            self._tree = cKDTree(_to_xyz(lat.values.ravel(), lon.values.ravel()))
+
+    def query(self, lats, lons) -> dict:
+        """Map point coordinates (scalars or arrays) to per-dimension cell indices."""
+        lats = np.atleast_1d(np.asarray(lats, dtype="float64"))
+        lons = np.atleast_1d(np.asarray(lons, dtype="float64"))
+        if self.kind == "curvilinear":
+            _, flat = self._tree.query(_to_xyz(lats, lons))
+            iy, ix = np.unravel_index(flat, self.shape)
+        else:
+            iy, ix = self._lat.query(lats), self._lon.query(lons)
+        return {self.dims[0]: iy, self.dims[1]: ix}
+
+
+def get_coord_names(ds, source=None) -> tuple:
+    """
+    Latitude/longitude coordinate names of a dataset, preferring the source's keys.
+    Only geographic coordinates (degrees) are accepted: projected x/y (metres) would
+    break the haversine/KD-tree lookups, so they raise instead of being guessed.
+    """
+    candidates_lat = ("lat", "latitude")
+    candidates_lon = ("lon", "longitude")
+    if source is not None:
+        candidates_lat = (source.lat_key,) + candidates_lat
+        candidates_lon = (source.lon_key,) + candidates_lon
+    lat_name = next((n for n in candidates_lat if n and n in ds.coords), None)
+    lon_name = next((n for n in candidates_lon if n and n in ds.coords), None)
+    if lat_name is None or lon_name is None:
+        raise ValueError(
+            f"No latitude/longitude coordinates found (coords: {list(ds.coords)}); "
+            "projected x/y grids are not supported"
+        )
+    return lat_name, lon_name
+
+
+# Un índice por fuente y grilla (el dominio cambia la grilla), compartido
+# por todas las sesiones del proceso.
+_GRID_INDEXES = {}
+_GRID_INDEXES_LOCK = threading.Lock()
+
+def get_grid_index(ds, source=None) -> GridIndex:
+    """Return the cached GridIndex for the dataset's grid, building it on first use."""
+    lat_name, lon_name = get_coord_names(ds, source)
+    lat, lon = ds[lat_name], ds[lon_name]
+    key = (
+        getattr(source, "id", None), lat_name, lon_name, lat.shape, lon.shape,
+        float(lat.values.flat[0]), float(lat.values.flat[-1]),
+        float(lon.values.flat[0]), float(lon.values.flat[-1]),
+    )
+    with _GRID_INDEXES_LOCK:
+        index = _GRID_INDEXES.get(key)
+        if index is None:
+            index = GridIndex(lat, lon)
+            _GRID_INDEXES[key] = index
+        return index
+
+def extract_points(ds, lats, lons, source=None):
+    """
+    Select many points in one vectorized (pointwise) isel.
+    The result has a new ``point`` dimension in place of the grid dimensions.
+    """
+    indexers = get_grid_index(ds, source).query(lats, lons)
+    return ds.isel({dim: xr.DataArray(idx, dims="point") for dim, idx in indexers.items()})
@@ -0,0 +1,204 @@
+"""
+Prueba de carga de la capa de datos con sesiones concurrentes simuladas.
+
+Reproduce secuencias de selecciones (como las que produce el sidebar) con N
+sesiones en paralelo contra las funciones request_* de utils.data_loader y la
+caché en disco, y reporta latencias p50/p95/p99 por etapa, throughput, tasa
+de aciertos de caché, trabajo duplicado (la misma entrada de caché calculada
+más de una vez) y errores (p.ej. ``database is locked`` de SQLite).
+
+Selecciones desde un JSONL (una por línea, mismas claves que el sidebar;
+fechas ISO, bbox como lista) o desde el historial ``request_executions``:
+
+    python -m utils.loadtest --jsonl selections.jsonl --sessions 8 --repeat 3
+    python -m utils.loadtest --from-db --sessions 16 --output report.json
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+from database.db_utils import get_available_datasets, get_db_connection
+from utils import blocks, data_loader
+from utils.pipeline import stage_request
+
+DEFAULTS = {
+    "agg": "mean",
+    "threshold": None,
+    "series_index": None,
+    "resample": None,
+    "resample_how": None,
+    "bbox": None,
+}
+
+
+def normalize_selection(raw: dict) -> dict:
+    """Selection with the sidebar's keys and types (dates, tuples, var_key)."""
+    selection = {**DEFAULTS, **raw}
+    selection["source_id"], selection["var_id"] = int(raw["source_id"]), int(raw["var_id"])
+    for key in ("start_date", "end_date"):
+        if isinstance(selection[key], str):
+            selection[key] = date.fromisoformat(selection[key][:10])
+    if selection["bbox"] is not None:
+        selection["bbox"] = tuple(float(v) for v in selection["bbox"])
+    if not selection.get("var_key"):
+        selection["var_key"] = next(
+            d.variable_key for d in get_available_datasets()
+            if d.source_id == selection["source_id"] and d.variable_id == selection["var_id"]
+        )
+    return selection
+
+def load_jsonl(path: str) -> list:
+    with open(path) as f:
+        return [normalize_selection(json.loads(line)) for line in f if line.strip()]
+
+def load_from_db() -> list:
+    """Selections replayed in the order they were executed (request_executions)."""
+    query = """
+    SELECT r.source_id, r.variable_id, r.aggregations, r.date_start, r.date_end,
+           r.lat_start, r.lat_end, r.lon_start, r.lon_end
+    FROM request_executions e
+    JOIN requests r ON e.request_id = r.id
+    ORDER BY e.execution_time
+    """
+    with get_db_connection() as conn:
+        rows = conn.execute(query).fetchall()
+
+    selections = []
+    for source_id, var_id, agg, start, end, lat0, lat1, lon0, lon1 in rows:
+        bbox = (lat0, lat1, lon0, lon1) if None not in (lat0, lat1, lon0, lon1) else None
+        selections.append(normalize_selection({
+            "source_id": source_id, "var_id": var_id, "agg": agg or "mean",
+            "start_date": start, "end_date": end, "bbox": bbox,
+        }))
+    return selections
+
+
+class Recorder:
+    """Thread-safe latencies, cache hits and cache-entry writes."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.hits = Counter()
+        self.lookups = Counter()
+        self.writes = Counter()
+        self.errors = Counter()
+
+    def timed(self, op: str, func, *args):
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        except Exception as e:
+            with self.lock:
+                self.errors[f"{op}: {type(e).__name__}: {e}"] += 1
+            return None
+        finally:
+            with self.lock:
+                self.latencies[op].append(time.perf_counter() - start)
+
+    def lookup(self, op: str, hit: bool):
+        with self.lock:
+            self.lookups[op] += 1
+            self.hits[op] += int(hit)
+
+    def wrap_writes(self, write_entry):
+        def counting_write_entry(path, writer, sources):
+            with self.lock:
+                self.writes[path] += 1
+            return write_entry(path, writer, sources)
+        return counting_write_entry
+
+
+def replay(selection: dict, recorder: Recorder):
+    """One step of a session: the dataset, layer and series stages of a selection."""
+    start = time.perf_counter()
+    ds = recorder.timed("dataset", data_loader.request_dataset, stage_request(selection, "dataset"))
+    if ds is not None:
+        for stage, func in (("layer", data_loader.request_layer), ("series", data_loader.request_series)):
+            request = stage_request(selection, stage)
+            path = data_loader.get_cache_path(stage if stage == "series" else "layers", request)
+            recorder.lookup(stage, data_loader.check_cache(path, data_loader.get_source_paths(request)))
+            recorder.timed(stage, func, ds, request)
+    with recorder.lock:
+        recorder.latencies["step"].append(time.perf_counter() - start)
+
+def percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+def run(selections: list, sessions: int, repeat: int = 1, shuffle: bool = True, seed: int = 0) -> dict:
+    """Replay the selections with `sessions` concurrent sessions and return the report."""
+    recorder = Recorder()
+    originals = (data_loader.write_entry, blocks.write_entry)
+    data_loader.write_entry = recorder.wrap_writes(originals[0])
+    blocks.write_entry = recorder.wrap_writes(originals[1])
+
+    def session(i):
+        sequence = list(selections) * repeat
+        if shuffle:
+            random.Random(seed + i).shuffle(sequence)
+        for selection in sequence:
+            replay(selection, recorder)
+
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=sessions) as pool:
+            list(pool.map(session, range(sessions)))
+    finally:
+        data_loader.write_entry, blocks.write_entry = originals
+    elapsed = time.perf_counter() - start
+
+    steps = len(recorder.latencies["step"])
+    lookups = sum(recorder.lookups.values())
+    return {
+        "sessions": sessions,
+        "steps": steps,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_steps_per_s": round(steps / elapsed, 3) if elapsed else 0.0,
+        "latency_ms": {
+            op: {
+                f"p{q}": round(percentile(values, q) * 1000, 1) for q in (50, 95, 99)
+            } | {"count": len(values)}
+            for op, values in recorder.latencies.items()
+        },
+        "cache_hit_ratio": round(sum(recorder.hits.values()) / lookups, 3) if lookups else 0.0,
+        "cache_hit_ratio_by_stage": {
+            op: round(recorder.hits[op] / n, 3) for op, n in recorder.lookups.items()
+        },
+        "cache_writes": sum(recorder.writes.values()),
+        "duplicate_writes": sum(n - 1 for n in recorder.writes.values()),
+        "errors": dict(recorder.errors),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent load test of the data layer")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--jsonl", help="Archivo JSONL con una selección por línea")
+    source.add_argument("--from-db", action="store_true", help="Reproducir request_executions")
+    parser.add_argument("--sessions", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=1, help="Veces que cada sesión repite la secuencia")
+    parser.add_argument("--no-shuffle", action="store_true", help="Todas las sesiones en el mismo orden")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Guardar el reporte JSON en este archivo")
+    args = parser.parse_args()
+
+    selections = load_jsonl(args.jsonl) if args.jsonl else load_from_db()
+    if not selections:
+        parser.error("No selections to replay")
+    report = run(selections, args.sessions, args.repeat, not args.no_shuffle, args.seed)
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Grafo de dependencias de las etapas de cómputo de la app.
+
+Cada etapa declara qué campos de la selección usa y de qué etapas depende.
+En cada rerun solo se recalculan las etapas cuyos campos (o los de sus
+padres) cambiaron; el resto se toma del estado guardado.
+
+    dataset ← source/var/dominio
+    layer   ← dataset + fechas/agregación/umbral/remuestreo
+    series  ← dataset + fechas/índice anual/umbral/remuestreo
+    points  ← dataset + fechas/puntos seleccionados
+    compare ← layer + series + otra fuente (comparación)
+    frames  ← dataset + fechas/agregación (animación mensual)
+"""
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, MutableMapping, Tuple
+
+from utils.tracing import span
+
+# Campos de la selección que afectan a cada etapa (sin contar los heredados).
+# También definen las claves de caché de cada etapa, así que cualquier otro
+# punto de entrada que quiera compartir la caché debe usarlas.
+STAGE_INPUTS = {
+    "dataset": ("source_id", "var_id", "var_key", "bbox"),
+    "layer": ("start_date", "end_date", "agg", "threshold", "resample", "resample_how"),
+    "series": ("start_date", "end_date", "series_index", "threshold", "resample", "resample_how"),
+    "points": ("start_date", "end_date", "points"),
+    "compare": ("compare",),
+    "frames": ("start_date", "end_date", "agg", "animate"),
+}
+
+STAGE_PARENTS = {
+    "dataset": (),
+    "layer": ("dataset",),
+    "series": ("dataset",),
+    "points": ("dataset",),
+    "compare": ("layer", "series"),
+    "frames": ("dataset",),
+}
+
+def stage_fields(stage: str) -> Tuple[str, ...]:
+    """All selection fields a stage depends on, including those of its parents."""
+    fields = []
+    for parent in STAGE_PARENTS[stage]:
+        fields.extend(stage_fields(parent))
+    fields.extend(STAGE_INPUTS[stage])
+    return tuple(dict.fromkeys(fields))
+
+def stage_request(selection: dict, stage: str) -> dict:
+    """Subset of the selection a stage depends on (used as request and cache key)."""
+    return {k: selection[k] for k in stage_fields(stage) if k in selection}
+
+
+@dataclass
+class StageTiming:
+    seconds: float
+    recomputed: bool
+
+
+@dataclass
+class Pipeline:
+    """
+    Ejecuta las etapas en orden memoizando cada una sobre sus propias entradas.
+
+    ``state`` es cualquier mapping persistente entre reruns (p.ej.
+    ``st.session_state``); ``funcs`` asocia cada etapa con una función que
+    recibe los resultados de sus padres y su sub‑request. ``versions`` asocia
+    etapas con una función del sub‑request cuyo valor también forma parte de
+    la clave (p.ej. la huella de los archivos fuente del dataset); la clave de
+    una etapa incluye la de sus padres, así que un cambio se propaga.
+    """
+    state: MutableMapping
+    funcs: Dict[str, Callable[..., Any]]
+    versions: Dict[str, Callable[[dict], Any]] = field(default_factory=dict)
+    timings: Dict[str, StageTiming] = field(default_factory=dict)
+
+    def _key(self, stage: str, selection: dict) -> tuple:
+        request = stage_request(selection, stage)
+        version = self.versions.get(stage)
+        return (
+            tuple(sorted(request.items())),
+            version(request) if version else None,
+            tuple(self._key(parent, selection) for parent in STAGE_PARENTS[stage]),
+        )
+
+    def run(self, selection: dict) -> Dict[str, Any]:
+        """Run every stage for the selection, recomputing only the stale ones."""
+        results = {}
+        self.timings = {}
+        for stage in STAGE_INPUTS:
+            if stage not in self.funcs:
+                continue
+            key = self._key(stage, selection)
+            cached = self.state.get(f"_stage_{stage}")
+            start = time.perf_counter()
+            with span(f"stage.{stage}") as s:
+                if cached is not None and cached[0] == key:
+                    value, recomputed = cached[1], False
+                else:
+                    parents = [results[p] for p in STAGE_PARENTS[stage]]
+                    value = self.funcs[stage](*parents, stage_request(selection, stage))
+                    self.state[f"_stage_{stage}"] = (key, value)
+                    recomputed = True
+                s.set(recomputed=recomputed)
+            self.timings[stage] = StageTiming(time.perf_counter() - start, recomputed)
+            results[stage] = value
+        return results
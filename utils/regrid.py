@@ -0,0 +1,197 @@
+"""
+Regrillado entre fuentes con matrices de pesos dispersas cacheadas.
+
+Para grillas rectilíneas (lat/lon 1D) los pesos son separables: la matriz 2D
+es ``kron(W_lat, W_lon)`` de dos matrices 1D, así que construirla es barato.
+Métodos:
+- ``bilinear``: interpolación lineal en cada eje,
+- ``conservative``: fracción de área solapada (en lat se usa sin(lat), así
+  el peso es proporcional al área real de la celda).
+
+Las matrices se guardan en cache/regrid/ por par de grillas y método (con su
+manifiesto, ver utils.cache_manifest, así sobreviven a ``gc``); aplicar
+un regrillado es un producto matriz‑vector disperso por paso de tiempo.
+Los NaN (p.ej. tierra en sst) se excluyen renormalizando por los pesos válidos.
+En grillas globales la longitud es periódica: se agrega una columna envuelta a
+cada lado antes de construir los pesos 1D, así la costura se interpola.
+"""
+import hashlib
+import os
+import threading
+
+import numpy as np
+import xarray as xr
+
+from utils.cache_manifest import is_valid, write_entry
+from utils.grid_index import get_coord_names
+
+REGRID_DIR = "cache/regrid"
+METHODS = ("bilinear", "conservative")
+
+
+def _bilinear_1d(src: np.ndarray, dst: np.ndarray):
+    """Rows: dst points; columns: src points. Outside the source range, nearest edge."""
+    from scipy import sparse
+
+    order = np.argsort(src)
+    s = src[order]
+    pos = np.clip(np.searchsorted(s, dst) - 1, 0, s.size - 2) if s.size > 1 else np.zeros(dst.size, int)
+    if s.size > 1:
+        frac = np.clip((dst - s[pos]) / (s[pos + 1] - s[pos]), 0.0, 1.0)
+        rows = np.repeat(np.arange(dst.size), 2)
+        cols = np.stack([order[pos], order[pos + 1]], axis=1).ravel()
+        vals = np.stack([1 - frac, frac], axis=1).ravel()
+    else:
+        rows, cols, vals = np.arange(dst.size), np.zeros(dst.size, int), np.ones(dst.size)
+    return sparse.csr_matrix((vals, (rows, cols)), shape=(dst.size, src.size))
+
+def _bounds(centers: np.ndarray) -> tuple:
+    """Cell bounds (lo, hi) from cell centers (any order)."""
+    order = np.argsort(centers)
+    c = centers[order]
+    mid = (c[1:] + c[:-1]) / 2 if c.size > 1 else np.array([])
+    first = c[0] - (mid[0] - c[0]) if mid.size else c[0] - 0.5
+    last = c[-1] + (c[-1] - mid[-1]) if mid.size else c[-1] + 0.5
+    edges = np.concatenate([[first], mid, [last]])
+    lo, hi = np.empty_like(c), np.empty_like(c)
+    lo[order], hi[order] = edges[:-1], edges[1:]
+    return lo, hi
+
+def _conservative_1d(src: np.ndarray, dst: np.ndarray, transform=None):
+    """Fraction of each dst cell covered by each src cell."""
+    from scipy import sparse
+
+    s_lo, s_hi = _bounds(src)
+    d_lo, d_hi = _bounds(dst)
+    if transform is not None:
+        s_lo, s_hi, d_lo, d_hi = (transform(v) for v in (s_lo, s_hi, d_lo, d_hi))
+    overlap = np.clip(
+        np.minimum(d_hi[:, None], s_hi[None, :]) - np.maximum(d_lo[:, None], s_lo[None, :]),
+        0, None,
+    )
+    return sparse.csr_matrix(overlap / (d_hi - d_lo)[:, None])
+
+def _to_frame(lon: np.ndarray, reference: np.ndarray) -> np.ndarray:
+    """Express longitudes in the frame of the reference grid (0–360 vs −180–180)."""
+    start = reference.min()
+    return start + (lon - start) % 360
+
+def _cyclic_lon(lon: np.ndarray) -> tuple:
+    """
+    Source longitudes padded with one wrapped column at each end when the grid
+    spans 360° (so the seam is interpolated, not extrapolated or truncated), and
+    the original column of every padded one. (lon, None) for regional grids.
+    """
+    if lon.size < 2:
+        return lon, None
+    order = np.argsort(lon)
+    s = lon[order]
+    step = float(np.median(np.diff(s)))
+    if abs(s[-1] - s[0] + step - 360.0) > step / 2:
+        return lon, None
+    padded = np.concatenate([[s[-1] - 360.0], lon, [s[0] + 360.0]])
+    columns = np.concatenate([[order[-1]], np.arange(lon.size), [order[0]]])
+    return padded, columns
+
+def _fold_columns(weights, columns: np.ndarray, n: int):
+    """Sum the weights of padded columns into their original columns."""
+    from scipy import sparse
+
+    fold = sparse.csr_matrix((np.ones(columns.size), (np.arange(columns.size), columns)), shape=(columns.size, n))
+    return (weights @ fold).tocsr()
+
+def build_weights(src_lat, src_lon, dst_lat, dst_lon, method: str = "bilinear"):
+    """Sparse (n_dst, n_src) weight matrix for row-major (lat, lon) flattened grids.
+    Longitude is periodic when the source grid spans 360°."""
+    from scipy import sparse
+
+    if method not in METHODS:
+        raise ValueError(f"Invalid regrid method. Use one of {METHODS}.")
+    src_lon = np.asarray(src_lon, dtype="float64")
+    dst_lon = _to_frame(np.asarray(dst_lon, dtype="float64"), src_lon)
+    padded_lon, columns = _cyclic_lon(src_lon)
+    if method == "bilinear":
+        w_lat = _bilinear_1d(np.asarray(src_lat, dtype="float64"), np.asarray(dst_lat, dtype="float64"))
+        w_lon = _bilinear_1d(padded_lon, dst_lon)
+    else:
+        sin_lat = lambda v: np.sin(np.deg2rad(np.clip(v, -90, 90)))
+        w_lat = _conservative_1d(np.asarray(src_lat, dtype="float64"), np.asarray(dst_lat, dtype="float64"), sin_lat)
+        w_lon = _conservative_1d(padded_lon, dst_lon)
+    if columns is not None:
+        w_lon = _fold_columns(w_lon, columns, src_lon.size)
+    return sparse.kron(w_lat, w_lon, format="csr")
+
+
+_WEIGHTS = {}
+_WEIGHTS_LOCK = threading.Lock()
+
+# Subir cuando cambie la construcción de los pesos (invalida los guardados)
+WEIGHTS_VERSION = "2"
+
+def _grid_key(src_lat, src_lon, dst_lat, dst_lon, method) -> str:
+    h = hashlib.sha1(f"{method}:{WEIGHTS_VERSION}".encode())
+    for values in (src_lat, src_lon, dst_lat, dst_lon):
+        h.update(np.ascontiguousarray(values, dtype="float64").tobytes())
+    return h.hexdigest()
+
+def _save_weights(weights, path: str):
+    from scipy import sparse
+
+    # se pasa un objeto archivo para que scipy no añada ".npz" a la ruta temporal
+    with open(path, "wb") as f:
+        sparse.save_npz(f, weights)
+    return weights
+
+def get_weights(src_lat, src_lon, dst_lat, dst_lon, method: str = "bilinear", sources: list = None):
+    """Weights for a grid pair, from memory, from cache/regrid/ or built and saved
+    as a cache entry of ``sources`` (the source paths of both grids)."""
+    from scipy import sparse
+
+    key = _grid_key(src_lat, src_lon, dst_lat, dst_lon, method)
+    with _WEIGHTS_LOCK:
+        weights = _WEIGHTS.get(key)
+        if weights is not None:
+            return weights
+        path = os.path.join(REGRID_DIR, f"{key}_{method}.npz")
+        if is_valid(path, sources):
+            weights = sparse.load_npz(path).tocsr()
+        else:
+            weights = build_weights(src_lat, src_lon, dst_lat, dst_lon, method)
+            write_entry(path, lambda tmp: _save_weights(weights, tmp), sources or [])
+        _WEIGHTS[key] = weights
+        return weights
+
+def _apply(values: np.ndarray, weights, shape: tuple) -> np.ndarray:
+    """Apply weights over the last two axes: (..., ny, nx) -> (..., ny', nx')."""
+    lead = values.shape[:-2]
+    flat = values.reshape(-1, values.shape[-2] * values.shape[-1]).T
+    valid = np.isfinite(flat)
+    total = weights @ np.where(valid, flat, 0.0)
+    norm = weights @ valid.astype("float64")
+    with np.errstate(invalid="ignore", divide="ignore"):
+        out = np.where(norm > 0, total / norm, np.nan)
+    return out.T.reshape(lead + shape)
+
+def regrid(ds: xr.Dataset, target: xr.Dataset, method: str = "bilinear", sources: list = None) -> xr.Dataset:
+    """Regrid every data variable of ds onto target's lat/lon grid (lazy-friendly).
+    ``sources`` are the source paths of both grids, recorded with the cached weights."""
+    src_lat_name, src_lon_name = get_coord_names(ds)
+    dst_lat_name, dst_lon_name = get_coord_names(target)
+    src_lat, src_lon = ds[src_lat_name].values, ds[src_lon_name].values
+    dst_lat, dst_lon = target[dst_lat_name].values, target[dst_lon_name].values
+    weights = get_weights(src_lat, src_lon, dst_lat, dst_lon, method, sources=sources)
+
+    out = xr.apply_ufunc(
+        _apply,
+        ds,
+        input_core_dims=[[src_lat_name, src_lon_name]],
+        output_core_dims=[["_lat_out", "_lon_out"]],
+        exclude_dims={src_lat_name, src_lon_name},
+        dask="parallelized",
+        output_dtypes=[np.float64],
+        dask_gufunc_kwargs={"output_sizes": {"_lat_out": dst_lat.size, "_lon_out": dst_lon.size}},
+        kwargs={"weights": weights, "shape": (dst_lat.size, dst_lon.size)},
+        keep_attrs=True,
+    )
+    out = out.rename({"_lat_out": dst_lat_name, "_lon_out": dst_lon_name})
+    return out.assign_coords({dst_lat_name: target[dst_lat_name], dst_lon_name: target[dst_lon_name]})
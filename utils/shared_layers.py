@@ -0,0 +1,256 @@
+"""
+Caché compartida de capas calientes mapeadas en memoria entre procesos.
+
+Con varios procesos de Streamlit detrás de un balanceador, cada uno abría su
+propia copia de las capas con ``xr.open_dataset``. Aquí cada capa se publica
+una vez como archivo sin comprimir en ``/dev/shm/era5-layers`` (memoria
+compartida; ``cache/mmap`` si no existe, o ``ERA5_SHARED_LAYERS_DIR``) y todos
+los procesos la abren con ``np.memmap(mode="r")``: comparten las mismas
+páginas físicas y ``render_map`` lee los valores sin copiarlos.
+
+Formato de archivo:
+
+    MAGIC (8 bytes) | largo del header (uint64) | header JSON | datos alineados
+
+El header lleva coords, attrs, la versión del pipeline, la huella de las
+fuentes y, por variable, dims/shape/dtype/offset. Los datos son float32
+alineados a ALIGNMENT bytes. La publicación es atómica (temporal +
+``os.replace``): un proceso que ya tiene mapeado el archivo anterior sigue
+leyéndolo hasta soltarlo. El total se limita a ``ERA5_SHARED_LAYERS_MAX_MB``
+borrando primero los archivos usados hace más tiempo (y los temporales de
+publicaciones caídas); cada proceso mantiene mapeadas como mucho
+``ERA5_SHARED_LAYERS_MAX_OPEN`` capas, así las borradas liberan su memoria.
+"""
+import json
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import xarray as xr
+
+from utils.cache_manifest import (
+    PIPELINE_VERSION, SHARED_LAYERS_DIR, STALE_TMP_AGE, TMP_MARKER, source_fingerprint,
+)
+
+MAGIC = b"ERA5LYR1"
+ALIGNMENT = 64
+SUFFIX = ".layer"
+
+SHARED_DIR = SHARED_LAYERS_DIR
+MAX_BYTES = int(float(os.environ.get("ERA5_SHARED_LAYERS_MAX_MB", "1024")) * 2**20)
+# capas mapeadas que cada proceso mantiene abiertas: un archivo borrado por _evict
+# solo libera sus páginas cuando ningún proceso lo tiene mapeado
+MAX_OPEN = int(os.environ.get("ERA5_SHARED_LAYERS_MAX_OPEN", "16"))
+
+
+def shared_path(key: str) -> str:
+    return os.path.join(SHARED_DIR, key + SUFFIX)
+
+def _align(n: int) -> int:
+    return -(-n // ALIGNMENT) * ALIGNMENT
+
+def _to_json(values: np.ndarray) -> dict:
+    """1-D/scalar coordinate as JSON (datetimes as ISO strings)."""
+    if np.issubdtype(values.dtype, np.datetime64):
+        return {"dtype": str(values.dtype), "values": np.datetime_as_string(values).tolist()}
+    return {"dtype": str(values.dtype), "values": values.tolist()}
+
+def _from_json(coord: dict) -> np.ndarray:
+    return np.asarray(coord["values"], dtype=coord["dtype"])
+
+def _plain(value):
+    """Attrs with numpy scalars/arrays as Python numbers/lists (so 0.5 stays 0.5)."""
+    if isinstance(value, dict):
+        return {str(k): _plain(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_plain(v) for v in value]
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def publish(ds: xr.Dataset, key: str, sources: list) -> bool:
+    """
+    Write a layer to the shared store (atomically). Returns False if it does not
+    fit in the store or has coordinates or attrs that cannot go in the header.
+    """
+    ds = ds.to_dataset() if isinstance(ds, xr.DataArray) else ds
+    arrays, variables, offset = [], {}, 0
+    for name, da in ds.data_vars.items():
+        values = np.asarray(da.values)
+        if np.issubdtype(values.dtype, np.floating):
+            values = values.astype("float32", copy=False)
+        if values.dtype.hasobject:
+            return False
+        values = np.ascontiguousarray(values)
+        variables[name] = {
+            "dims": list(da.dims),
+            "shape": list(values.shape),
+            "dtype": values.dtype.str,
+            "offset": offset,
+            "attrs": _plain(da.attrs),
+        }
+        arrays.append(values)
+        offset = _align(offset + values.nbytes)
+    if offset > MAX_BYTES:
+        return False
+
+    coords = {}
+    for name, coord in ds.coords.items():
+        if coord.ndim > 1:
+            return False
+        coords[name] = {"dims": list(coord.dims), **_to_json(coord.values)}
+
+    try:
+        header = json.dumps({
+            "pipeline_version": PIPELINE_VERSION,
+            "fingerprint": source_fingerprint(sources),
+            "attrs": _plain(ds.attrs),
+            "coords": coords,
+            "variables": variables,
+        }).encode()
+    except TypeError as e:
+        # attrs que no son JSON (p.ej. fechas): la capa se sirve desde cache/layers/
+        print(f"Could not publish shared layer {key}: {e}")
+        return False
+    data_start = _align(len(MAGIC) + 8 + len(header))
+
+    os.makedirs(SHARED_DIR, exist_ok=True)
+    _evict(offset + data_start)
+    path = shared_path(key)
+    tmp = f"{path}{TMP_MARKER}{os.getpid()}-{threading.get_ident()}"
+    try:
+        with open(tmp, "wb") as f:
+            f.write(MAGIC + struct.pack("<Q", len(header)) + header)
+            for values, meta in zip(arrays, variables.values()):
+                f.seek(data_start + meta["offset"])
+                f.write(values.tobytes())
+            f.truncate(data_start + offset)
+        os.replace(tmp, path)
+    except OSError as e:
+        # p.ej. /dev/shm lleno: la capa sigue sirviéndose desde cache/layers/
+        print(f"Could not publish shared layer {key}: {e}")
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        return False
+    return True
+
+def _evict(incoming: int):
+    """Delete stale temporaries and the least recently used layers until `incoming`
+    more bytes fit, then drop this process's maps of files that are gone."""
+    entries = []
+    for entry in os.scandir(SHARED_DIR):
+        try:
+            st = entry.stat()
+        except FileNotFoundError:
+            continue
+        if TMP_MARKER in entry.name:
+            if time.time() - st.st_mtime > STALE_TMP_AGE:
+                _unlink(entry.path)
+        elif entry.name.endswith(SUFFIX):
+            entries.append((max(st.st_atime, st.st_mtime), st.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total + incoming <= MAX_BYTES:
+            break
+        # los procesos que lo tengan mapeado conservan sus páginas hasta soltarlo
+        _unlink(path)
+        total -= size
+    _drop_stale_maps()
+
+def _unlink(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+# ruta -> ((inode, mtime_ns), Dataset mapeado en este proceso, huella de las fuentes),
+# del menos al más recientemente usado
+_OPEN = OrderedDict()
+_OPEN_LOCK = threading.Lock()
+
+def _drop_stale_maps():
+    """Forget maps whose file was deleted or replaced (a new inode)."""
+    with _OPEN_LOCK:
+        for path, (stamp, _, _) in list(_OPEN.items()):
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                del _OPEN[path]
+                continue
+            if st.st_ino != stamp[0]:
+                del _OPEN[path]
+
+def _read_header(path: str):
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            return None, 0
+        (length,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(length))
+    return header, _align(len(MAGIC) + 8 + length)
+
+def _map(path: str, header: dict, data_start: int) -> xr.Dataset:
+    coords = {
+        name: (coord["dims"], _from_json(coord))
+        for name, coord in header["coords"].items()
+    }
+    data_vars = {}
+    for name, meta in header["variables"].items():
+        shape = tuple(meta["shape"])
+        if 0 in shape:
+            values = np.empty(shape, dtype=meta["dtype"])
+        else:
+            values = np.memmap(path, dtype=meta["dtype"], mode="r",
+                               offset=data_start + meta["offset"], shape=shape)
+        data_vars[name] = (meta["dims"], values, meta["attrs"])
+    return xr.Dataset(data_vars, coords=coords, attrs=header["attrs"])
+
+def open_layer(key: str, sources: list):
+    """
+    Return the shared layer as a Dataset backed by read-only memory maps, or
+    None if it is not published (or is stale for the sources / pipeline version).
+    """
+    path = shared_path(key)
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        with _OPEN_LOCK:
+            _OPEN.pop(path, None)
+        return None
+    # marcar como usada para _evict (sin tocar mtime, que identifica la versión)
+    try:
+        os.utime(path, ns=(time.time_ns(), st.st_mtime_ns))
+    except OSError:
+        pass
+
+    stamp = (st.st_ino, st.st_mtime_ns)
+    with _OPEN_LOCK:
+        cached = _OPEN.get(path)
+        if cached is not None:
+            _OPEN.move_to_end(path)
+    if cached is not None and cached[0] == stamp:
+        ds, fingerprint = cached[1], cached[2]
+        return ds if fingerprint == source_fingerprint(sources) else None
+
+    try:
+        header, data_start = _read_header(path)
+    except (OSError, ValueError):
+        return None
+    if header is None or header.get("pipeline_version") != PIPELINE_VERSION:
+        return None
+    if header.get("fingerprint") != source_fingerprint(sources):
+        return None
+
+    ds = _map(path, header, data_start)
+    with _OPEN_LOCK:
+        _OPEN[path] = (stamp, ds, header["fingerprint"])
+        _OPEN.move_to_end(path)
+        while len(_OPEN) > MAX_OPEN:
+            _OPEN.popitem(last=False)
+    return ds
@@ -0,0 +1,93 @@
+"""
+Sketches de cuantiles por celda (histograma por celda) fusionables.
+
+Un percentil exacto sobre décadas horarias no cabe en memoria; en su lugar
+cada bloque temporal (p.ej. un año) se resume en un histograma por celda con
+bordes de bin compartidos. Los histogramas de distintos bloques se fusionan
+sumando los conteos, se pueden cachear por bloque, y el cuantil se obtiene
+interpolando dentro del bin: el error es como mucho el ancho de un bin
+((max - min) / n_bins).
+"""
+import numpy as np
+import xarray as xr
+
+N_BINS = 256
+
+
+def get_edges(vmin: float, vmax: float, n_bins: int = N_BINS) -> np.ndarray:
+    """Shared bin edges for a variable's value range."""
+    if not vmax > vmin:
+        vmax = vmin + 1.0
+    return np.linspace(vmin, vmax, n_bins + 1)
+
+def _histogram_counts(values: np.ndarray, edges: np.ndarray) -> np.ndarray:
+    """Per-cell histogram over the last axis: (..., time) -> (..., bin)."""
+    n_bins = edges.size - 1
+    cells = values.shape[:-1]
+    flat = values.reshape(-1, values.shape[-1])
+    n_cells = flat.shape[0]
+
+    valid = np.isfinite(flat)
+    bins = np.clip(np.searchsorted(edges, flat, side="right") - 1, 0, n_bins - 1)
+    cell = np.broadcast_to(np.arange(n_cells)[:, None], flat.shape)
+    index = (cell * n_bins + bins)[valid]
+    counts = np.bincount(index, minlength=n_cells * n_bins).astype("uint32")
+    return counts.reshape(cells + (n_bins,))
+
+def _sketch_chunk(da: xr.DataArray, edges: np.ndarray, dim: str) -> xr.DataArray:
+    return xr.apply_ufunc(
+        _histogram_counts,
+        da,
+        input_core_dims=[[dim]],
+        output_core_dims=[["bin"]],
+        dask="parallelized",
+        output_dtypes=[np.uint32],
+        dask_gufunc_kwargs={"output_sizes": {"bin": edges.size - 1}},
+        kwargs={"edges": edges},
+    )
+
+def sketch(da: xr.DataArray, edges: np.ndarray, dim: str = "time") -> xr.DataArray:
+    """
+    Histogram sketch of a (lazy) DataArray along ``dim``; result has a ``bin`` dim.
+    On a dask array each existing chunk along ``dim`` (one per source file) is
+    sketched on its own and the counts are added, so chunks are never merged
+    along time and memory stays bounded by the source chunks.
+    """
+    if da.chunks is None:
+        return _sketch_chunk(da, edges, dim)
+    counts, start = None, 0
+    for size in da.chunksizes[dim]:
+        part = _sketch_chunk(da.isel({dim: slice(start, start + size)}), edges, dim)
+        counts = part if counts is None else counts + part
+        start += size
+    return counts
+
+def merge(sketches: list) -> xr.DataArray:
+    """Merge sketches built with the same edges (sum of counts)."""
+    total = sketches[0].astype("uint64")
+    for other in sketches[1:]:
+        total = total + other
+    return total
+
+def _quantile_from_counts(counts: np.ndarray, edges: np.ndarray, q: float) -> np.ndarray:
+    cumulative = np.cumsum(counts, axis=-1)
+    total = cumulative[..., -1]
+    target = q * total
+    b = np.minimum((cumulative < target[..., None]).sum(axis=-1), counts.shape[-1] - 1)
+    below = np.where(b > 0, np.take_along_axis(cumulative, np.maximum(b - 1, 0)[..., None], -1)[..., 0], 0)
+    in_bin = np.take_along_axis(counts, b[..., None], -1)[..., 0]
+    frac = np.where(in_bin > 0, (target - below) / np.maximum(in_bin, 1), 0.5)
+    width = edges[1] - edges[0]
+    result = edges[b] + frac * width
+    return np.where(total > 0, result, np.nan)
+
+def quantile(counts: xr.DataArray, edges: np.ndarray, q: float) -> xr.DataArray:
+    """Approximate quantile q (0-1) per cell from a merged sketch."""
+    return xr.apply_ufunc(
+        _quantile_from_counts,
+        counts,
+        input_core_dims=[["bin"]],
+        dask="parallelized",
+        output_dtypes=[np.float64],
+        kwargs={"edges": edges, "q": q},
+    )
@@ -0,0 +1,62 @@
+"""
+Perfil de tiempo de import del arranque de la app.
+
+Ejecuta los imports de app.py en un intérprete nuevo con ``-X importtime`` y
+muestra los módulos que más tiempo acumulan, para vigilar el arranque en frío:
+
+    python -m utils.startup_profile
+    python -m utils.startup_profile --top 30 --module components.map_plot
+"""
+import argparse
+import subprocess
+import sys
+
+# Lo que importa app.py en el primer render (en el mismo orden)
+STARTUP_MODULES = [
+    "streamlit",
+    "utils.cache",
+    "components.sidebar",
+    "utils.data_loader",
+    "components.map_view",
+    "components.series_view",
+    "components.roadmap_expander",
+]
+
+def profile_imports(modules: list) -> list:
+    """Import modules in a fresh interpreter and return (cumulative_us, self_us, name) rows."""
+    code = "; ".join(f"import {m}" for m in modules)
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1])
+
+    rows = []
+    for line in proc.stderr.splitlines():
+        # formato: "import time:   self [us] | cumulative | imported package"
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((int(cumulative_us), int(self_us), name[1:].rstrip()))
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--top", type=int, default=20, help="Número de módulos a mostrar")
+    parser.add_argument("--module", action="append", help="Módulo(s) a perfilar en lugar de los de app.py")
+    args = parser.parse_args()
+
+    modules = args.module or STARTUP_MODULES
+    rows = profile_imports(modules)
+    top_level = [r for r in rows if not r[2].startswith(" ")]
+    total_ms = sum(r[0] for r in top_level) / 1000
+
+    print(f"Total import time: {total_ms:.0f} ms ({len(rows)} modules)")
+    print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    for cumulative_us, self_us, name in sorted(rows, reverse=True)[:args.top]:
+        print(f"{cumulative_us / 1000:14.1f} {self_us / 1000:9.1f}  {name.strip()}")
+
+if __name__ == "__main__":
+    main()
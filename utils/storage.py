@@ -0,0 +1,107 @@
+"""
+Política de almacenamiento compacto para capas y agregados en caché.
+
+Por variable (tabla ``variables``):
+- con ``precision``: empaquetado int16 con scale_factor/add_offset, si el rango
+  de valores cabe en 65 534 pasos de esa precisión;
+- si no (o si no cabe): float32.
+
+Siempre con compresión (zlib por defecto, zstd con ERA5_CACHE_COMPRESSION=zstd)
+y chunks acotados. El error máximo medido al empaquetar se guarda en el
+atributo ``packing_max_abs_error`` de cada variable.
+"""
+import os
+
+import numpy as np
+import xarray as xr
+
+from utils.tracing import traced
+
+INT16_FILL = np.int16(-32768)
+INT16_LEVELS = 65534      # valores útiles de int16 (sin el _FillValue)
+INT16_MAX = 32767
+COMPLEVEL = 4
+MAX_CHUNK = {"time": 120}
+MAX_SPATIAL_CHUNK = 256
+
+
+def _compression() -> dict:
+    compression = os.environ.get("ERA5_CACHE_COMPRESSION", "zlib").lower()
+    if compression == "zstd":
+        return {"compression": "zstd", "complevel": COMPLEVEL, "shuffle": True}
+    return {"zlib": True, "complevel": COMPLEVEL, "shuffle": True}
+
+def _chunksizes(da: xr.DataArray) -> tuple:
+    return tuple(
+        min(size, MAX_CHUNK.get(dim, MAX_SPATIAL_CHUNK))
+        for dim, size in zip(da.dims, da.shape)
+    )
+
+def pack_int16(values: np.ndarray, precision: float):
+    """
+    Return (scale_factor, add_offset, max_abs_error) for packing the values as
+    int16 with the given precision, or None if their range does not fit.
+    """
+    finite = values[np.isfinite(values)]
+    if finite.size == 0:
+        return None
+    vmin, vmax = float(finite.min()), float(finite.max())
+    # margen de 2 niveles: offset/scale en float32 pueden correr el redondeo de los
+    # extremos a ±32768, que es el _FillValue (o desborda int16)
+    if (vmax - vmin) / precision > INT16_LEVELS - 2:
+        return None
+
+    scale = np.float32(precision)
+    offset = np.float32((vmax + vmin) / 2)
+    packed = np.clip(np.rint((finite - offset) / scale), -INT16_MAX, INT16_MAX)
+    error = float(np.abs(packed * scale + offset - finite).max())
+    return scale, offset, error
+
+def get_encoding(ds: xr.Dataset, variable=None) -> dict:
+    """
+    Build the to_netcdf encoding for every data variable of an in-memory dataset
+    and record the measured packing error in its attrs.
+    """
+    precision = getattr(variable, "precision", None)
+    encoding = {}
+    for name, da in ds.data_vars.items():
+        if da.ndim == 0:
+            continue
+        if not np.issubdtype(da.dtype, np.floating):
+            encoding[name] = dict(_compression(), chunksizes=_chunksizes(da))
+            continue
+
+        values = da.values
+        packing = pack_int16(values, precision) if precision else None
+        if packing is not None:
+            scale, offset, error = packing
+            enc = {
+                "dtype": "int16",
+                "scale_factor": scale,
+                "add_offset": offset,
+                "_FillValue": INT16_FILL,
+            }
+        else:
+            finite = values[np.isfinite(values)]
+            error = float(np.abs(finite.astype("float32") - finite).max()) if finite.size else 0.0
+            enc = {"dtype": "float32", "_FillValue": np.float32(np.nan)}
+
+        da.attrs["packing_max_abs_error"] = error
+        enc.update(_compression(), chunksizes=_chunksizes(da))
+        encoding[name] = enc
+    return encoding
+
+@traced("store")
+def save_netcdf(obj, path: str, variable=None) -> xr.Dataset:
+    """
+    Compute (if lazy) and write a layer/aggregate with the compact storage
+    policy. Returns the in-memory dataset that was written.
+    """
+    ds = obj.to_dataset() if isinstance(obj, xr.DataArray) else obj
+    # copia superficial: las coordenadas pueden compartirse con el dataset fuente
+    ds = ds.copy().load()
+    # la codificación heredada de los archivos fuente no aplica a la caché
+    for var in ds.variables.values():
+        var.encoding = {}
+    ds.to_netcdf(path, encoding=get_encoding(ds, variable))
+    return ds
@@ -0,0 +1,170 @@
+"""
+Instrumentación opcional por etapas: load → reduce → render.
+
+Se activa con ``ERA5_TRACE=1`` (o ``enable()``). Cada etapa registra un span
+con duración, bytes, formas de los arrays y nº de tareas de Dask; los spans
+se anidan por hilo y se exportan como JSON lines con campos compatibles con
+OpenTelemetry (traceId, spanId, parentSpanId, start/endTimeUnixNano,
+attributes) en ``ERA5_TRACE_FILE`` (por defecto traces/spans.jsonl).
+
+    with span("load", path=path) as s:
+        ds = ...
+        s.record(ds)
+
+    @traced("reduce.layer")
+    def get_layer(...): ...
+
+Ojo: en objetos perezosos el span mide la construcción del grafo; el cómputo
+aparece en el span de la etapa que lo materializa (p.ej. ``store``).
+"""
+import functools
+import json
+import os
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+
+_ENABLED = os.environ.get("ERA5_TRACE", "").lower() in ("1", "true", "yes")
+_TRACE_FILE = os.environ.get("ERA5_TRACE_FILE", "traces/spans.jsonl")
+_FILE_LOCK = threading.Lock()
+_local = threading.local()
+
+
+def enable(path: str = None):
+    """Turn tracing on (optionally changing the export file)."""
+    global _ENABLED, _TRACE_FILE
+    _ENABLED = True
+    if path:
+        _TRACE_FILE = path
+
+def is_enabled() -> bool:
+    return _ENABLED
+
+def describe(obj) -> dict:
+    """Size attributes of a result: bytes, shapes and Dask task count."""
+    attrs = {}
+    nbytes = getattr(obj, "nbytes", None)
+    if nbytes is None and hasattr(obj, "memory_usage"):
+        nbytes = int(obj.memory_usage(deep=True).sum())
+    if nbytes is not None:
+        attrs["bytes"] = int(nbytes)
+    if hasattr(obj, "data_vars"):
+        attrs["shape"] = {name: list(da.shape) for name, da in obj.data_vars.items()}
+    elif hasattr(obj, "shape"):
+        attrs["shape"] = list(obj.shape)
+    graph = obj.__dask_graph__() if hasattr(obj, "__dask_graph__") else None
+    if graph is not None:
+        attrs["dask_tasks"] = len(graph)
+    return attrs
+
+
+class Span:
+    def __init__(self, name: str, trace_id: str, parent_id: str, attributes: dict):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes = dict(attributes)
+        self.depth = 0
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def record(self, obj):
+        """Add the size attributes of a stage result."""
+        self.attributes.update(describe(obj))
+        return obj
+
+    def to_dict(self) -> dict:
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id,
+            "name": self.name,
+            "startTimeUnixNano": self.start_ns,
+            "endTimeUnixNano": self.end_ns,
+            "durationMs": round(self.duration_ms, 3),
+            "attributes": self.attributes,
+        }
+
+
+class _NullSpan:
+    def set(self, **attributes):
+        pass
+
+    def record(self, obj):
+        return obj
+
+
+def _stack() -> list:
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+        _local.collectors = []
+    return _local.stack
+
+def _export(span: Span):
+    directory = os.path.dirname(_TRACE_FILE)
+    with _FILE_LOCK:
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(_TRACE_FILE, "a") as f:
+            f.write(json.dumps(span.to_dict(), default=str) + "\n")
+
+@contextmanager
+def span(name: str, **attributes):
+    """Record a span around a block (no-op when tracing is disabled)."""
+    if not _ENABLED:
+        yield _NullSpan()
+        return
+
+    stack = _stack()
+    parent = stack[-1] if stack else None
+    current = Span(
+        name,
+        trace_id=parent.trace_id if parent else secrets.token_hex(16),
+        parent_id=parent.span_id if parent else None,
+        attributes=attributes,
+    )
+    current.depth = len(stack)
+    stack.append(current)
+    try:
+        yield current
+    except Exception as e:
+        current.set(error=repr(e))
+        raise
+    finally:
+        current.end_ns = time.time_ns()
+        stack.pop()
+        for collector in _local.collectors:
+            collector.append(current)
+        _export(current)
+
+def traced(name: str):
+    """Decorator: record a span per call, with the size attributes of the result."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _ENABLED:
+                return func(*args, **kwargs)
+            with span(name) as s:
+                return s.record(func(*args, **kwargs))
+        return wrapper
+    return decorator
+
+@contextmanager
+def collect():
+    """Collect the spans finished in this thread inside the block (e.g. one rerun)."""
+    _stack()
+    spans = []
+    _local.collectors.append(spans)
+    try:
+        yield spans
+    finally:
+        _local.collectors.remove(spans)